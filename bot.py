@@ -11,6 +11,12 @@ from aiogram.types.input_file import FSInputFile
 from aiogram.client.session.aiohttp import AiohttpSession
 
 import settings
+from db import async_db_session
+from payment.qiwi_payment import QIWIPayment
+from payment.webhook import PaymentNotificationHandler
+from server_manager import ServerConnectionPool
+from server_manager.managers import PaymentManager
+from middlewares import UserMiddleware
 from handlers import introduction, buy_service, create_bill, profile, user_agreement
 from expiration_notifier.manager import ExpirationManager
 from expiration_notifier.notifier import TgBotNotifier
@@ -37,11 +43,14 @@ async def on_startup(dispatcher: Dispatcher, bot: Bot):
 
     # Запускаем проверку подключений и отправку уведомлений
     asyncio.get_event_loop().create_task(notify(bot))
+    asyncio.get_event_loop().create_task(async_db_session.log_stats())
 
 
 async def on_shutdown(dispatcher: Dispatcher, bot: Bot):
     webhook = await bot.delete_webhook()
     print("======== DELETE WEBHOOK ======== ->", webhook)
+    await QIWIPayment.close_session()
+    await async_db_session.dispose()
 
 
 def add_routes(dispatcher: Dispatcher):
@@ -61,11 +70,37 @@ def main():
     dp.startup.register(on_startup)
     dp.shutdown.register(on_shutdown)
 
+    # Пользователь базы для обработчиков (аргумент `user`).
+    user_middleware = UserMiddleware()
+    dp.message.outer_middleware(user_middleware)
+    dp.callback_query.outer_middleware(user_middleware)
+
     # Добавляем роуты
     add_routes(dp)
 
     app = web.Application()
     SimpleRequestHandler(dispatcher=dp, bot=bot).register(app, path=settings.BOT_PATH)
+
+    # Уведомления QIWI об оплате сразу активируют подключения.
+    # Очередь сроков аренды живет в процессе manager.py, поэтому продленные
+    # сроки сюда не передаются: перед заморозкой VPNControlManager блокирует
+    # подключения и заново читает срок аренды из базы.
+    ssh_pool = ServerConnectionPool()
+    payment_manager = PaymentManager(ssh_pool)
+    PaymentNotificationHandler(
+        QIWIPayment(), on_notification=payment_manager.process_bill_status
+    ).register(app, path=settings.PAYMENT_WEBHOOK_PATH)
+
+    async def start_ssh_pool(app_: web.Application):
+        # Закрывает простаивающие SSH подключения.
+        app_["ssh_pool_task"] = asyncio.create_task(ssh_pool.run())
+
+    async def close_ssh_pool(app_: web.Application):
+        app_["ssh_pool_task"].cancel()
+        await ssh_pool.close()
+
+    app.on_startup.append(start_ssh_pool)
+    app.on_cleanup.append(close_ssh_pool)
     setup_application(app, dp, bot=bot)
 
     web.run_app(app, host=settings.WEB_SERVER_HOST, port=settings.WEB_SERVER_PORT)
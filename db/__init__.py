@@ -1,2 +1,3 @@
 from .db_connector import async_db_session
-from .models import Server, VPNConnection, User, ActiveBills
+from .models import Server, VPNConnection, User, ActiveBills, server_catalog
+from .profile import load_user_profile, ProfileData, ProfileConnection, ProfileBill
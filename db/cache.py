@@ -0,0 +1,119 @@
+import asyncio
+import time
+from typing import Generic, TypeVar
+
+from sqlalchemy.orm.strategy_options import lazyload
+from sqlalchemy.sql import select
+
+from .db_connector import async_db_session
+
+T = TypeVar("T")
+
+
+class ModelCatalogCache(Generic[T]):
+    """
+    Кэш всех записей небольшой, редко меняющейся таблицы (например, серверов).
+
+    Записи загружаются одним запросом и хранятся `ttl` секунд,
+    либо до явного сброса через `invalidate()`.
+    Номер версии увеличивается при каждой загрузке, по нему зависимые кэши
+    понимают, что данные могли измениться.
+
+    Отсутствующий идентификатор перезагружает записи не чаще одного раза
+    в `miss_reload_interval` секунд, а не найденные после перезагрузки
+    идентификаторы запоминаются до следующей загрузки.
+    """
+
+    def __init__(
+        self, model: type[T], ttl: int = 60 * 5, miss_reload_interval: int = 10
+    ):
+        self._model = model
+        self.ttl = ttl
+        self.miss_reload_interval = miss_reload_interval
+
+        self._items: tuple[T, ...] = ()
+        self._by_id: dict[int, T] = {}
+        # Идентификаторы, которых не было в таблице при последней загрузке.
+        self._missing: set[int] = set()
+        self._loaded_at: float | None = None
+        self._lock = asyncio.Lock()
+
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    async def all(self) -> tuple[T, ...]:
+        """
+        # Возвращает все записи.
+        """
+        await self._ensure_loaded()
+        return self._items
+
+    async def get(self, id: int) -> T:
+        """
+        # Возвращает запись по идентификатору.
+        :return: Объект или вызовет исключение DoesNotExists.
+        """
+        await self._ensure_loaded()
+
+        if id not in self._by_id and id not in self._missing:
+            # Запись могла появиться после загрузки кэша.
+            loaded_at = self._loaded_at
+            if (
+                loaded_at is None
+                or time.monotonic() - loaded_at >= self.miss_reload_interval
+            ):
+                self.invalidate()
+                await self._ensure_loaded()
+                if id not in self._by_id:
+                    self._missing.add(id)
+
+        try:
+            return self._by_id[id]
+        except KeyError:
+            raise self._model.DoesNotExists
+
+    def invalidate(self) -> None:
+        """
+        # Сбрасывает кэш, следующее обращение загрузит записи заново.
+        """
+        self._loaded_at = None
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._items),
+            "version": self.version,
+        }
+
+    def _is_fresh(self) -> bool:
+        return (
+            self._loaded_at is not None
+            and time.monotonic() - self._loaded_at < self.ttl
+        )
+
+    async def _ensure_loaded(self) -> None:
+        if self._is_fresh():
+            self.hits += 1
+            return
+
+        async with self._lock:
+            if self._is_fresh():
+                # Пока ждали, записи загрузил другой запрос.
+                self.hits += 1
+                return
+
+            self.misses += 1
+            # Связанные модели не загружаем, в кэше только сами записи.
+            query = select(self._model).order_by(self._model.id).options(lazyload("*"))
+            async with async_db_session() as session:
+                result = await session.execute(query)
+                items = tuple(result.scalars().all())
+
+            self._items = items
+            self._by_id = {item.id: item for item in items}
+            self._missing = set()
+            self._loaded_at = time.monotonic()
+            self.version += 1
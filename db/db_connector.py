@@ -1,13 +1,72 @@
+import asyncio
+import logging
 import os
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator
 
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from .migrations import run_migrations
 
 
 class Base(DeclarativeBase):
     pass
 
 
+class DatabaseStats:
+    """
+    Счетчики использования пула подключений к базе.
+    """
+
+    def __init__(self):
+        self.checkouts = 0
+        self.checkins = 0
+        # Сколько всего и максимально ждали свободное подключение (секунды).
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.sessions = 0
+        self.queries = 0
+
+
+# Общие для всех пулов процесса: пул пересоздается движком при `dispose`.
+db_stats = DatabaseStats()
+
+
+class InstrumentedAsyncPool(AsyncAdaptedQueuePool):
+    """
+    Пул подключений, который учитывает время ожидания свободного подключения.
+    """
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            wait_time = time.perf_counter() - started
+            db_stats.wait_time += wait_time
+            db_stats.max_wait_time = max(db_stats.max_wait_time, wait_time)
+
+
+# Сессия текущей единицы работы (`unit_of_work`) и задача, которая ее открыла.
+# Задачи, созданные внутри блока, копируют контекст, но сессию не получают:
+# AsyncSession нельзя использовать из нескольких задач одновременно.
+_current_session: ContextVar[tuple[asyncio.Task, AsyncSession] | None] = ContextVar(
+    "current_db_session", default=None
+)
+
+
+def _unit_of_work_session() -> AsyncSession | None:
+    current = _current_session.get()
+    if current is not None and current[0] is asyncio.current_task():
+        return current[1]
+    return None
+
+
 class AsyncDatabaseSession:
     def __init__(self):
         login = os.getenv("MYSQL_LOGIN")
@@ -16,23 +75,137 @@ class AsyncDatabaseSession:
         host = os.getenv("MYSQL_HOST")
 
         self._engine = create_async_engine(
-            f"mysql+aiomysql://{login}:{password}@{host}/{database}?charset=utf8mb4"
+            f"mysql+aiomysql://{login}:{password}@{host}/{database}?charset=utf8mb4",
+            poolclass=InstrumentedAsyncPool,
+            pool_size=int(os.getenv("MYSQL_POOL_SIZE", 10)),
+            max_overflow=int(os.getenv("MYSQL_MAX_OVERFLOW", 20)),
+            pool_timeout=int(os.getenv("MYSQL_POOL_TIMEOUT", 30)),
+            # MySQL закрывает неактивные подключения (wait_timeout),
+            # поэтому пересоздаем их раньше и проверяем перед выдачей.
+            pool_recycle=int(os.getenv("MYSQL_POOL_RECYCLE", 60 * 30)),
+            pool_pre_ping=True,
         )
         self._session = async_sessionmaker(
             self._engine,
             expire_on_commit=False,
             class_=AsyncSession,
         )
+        self._register_events()
+
+    def _register_events(self):
+        sync_engine = self._engine.sync_engine
+
+        @event.listens_for(sync_engine, "checkout")
+        def on_checkout(*_):
+            db_stats.checkouts += 1
+
+        @event.listens_for(sync_engine, "checkin")
+        def on_checkin(*_):
+            db_stats.checkins += 1
+
+        @event.listens_for(sync_engine, "before_cursor_execute")
+        def on_execute(*_):
+            db_stats.queries += 1
 
     def __call__(self):
+        db_stats.sessions += 1
         return self._session()
 
     def __getattr__(self, name):
         return getattr(self._session, name)
 
+    @asynccontextmanager
+    async def unit_of_work(self) -> AsyncIterator[AsyncSession]:
+        """
+        # Выполняет несколько операций ModelAdmin в одной сессии и транзакции.
+
+            async with async_db_session.unit_of_work():
+                await bill.delete()
+                await connection.update(available=False)
+
+        Изменения фиксируются при выходе из блока, либо отменяются при ошибке.
+        Вложенный вызов в той же задаче использует уже открытую сессию,
+        задачи, созданные внутри блока (`gather`, `create_task`), работают
+        в своих сессиях.
+        """
+        if (session := _unit_of_work_session()) is not None:
+            yield session
+            return
+
+        async with self() as session:
+            token = _current_session.set((asyncio.current_task(), session))
+            try:
+                yield session
+                await session.commit()
+            except BaseException:
+                await session.rollback()
+                raise
+            finally:
+                _current_session.reset(token)
+
+    @asynccontextmanager
+    async def session_scope(self) -> AsyncIterator[AsyncSession]:
+        """
+        # Сессия текущей единицы работы, либо новая сессия.
+        """
+        if (session := _unit_of_work_session()) is not None:
+            yield session
+        else:
+            async with self() as session:
+                yield session
+
+    @staticmethod
+    async def commit(session: AsyncSession):
+        """
+        # Фиксирует изменения сессии из `session_scope`.
+        Внутри единицы работы только отправляет их в базу, фиксирует `unit_of_work`.
+        """
+        if _unit_of_work_session() is session:
+            await session.flush()
+        else:
+            await session.commit()
+
+    @property
+    def stats(self) -> dict:
+        """
+        # Состояние пула подключений и счетчики запросов.
+        """
+        pool = self._engine.pool
+        return {
+            "pool_size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "checkouts": db_stats.checkouts,
+            "checkins": db_stats.checkins,
+            "wait_time": round(db_stats.wait_time, 3),
+            "max_wait_time": round(db_stats.max_wait_time, 3),
+            "sessions": db_stats.sessions,
+            "queries": db_stats.queries,
+            "queries_per_session": (
+                round(db_stats.queries / db_stats.sessions, 2)
+                if db_stats.sessions
+                else 0
+            ),
+        }
+
+    async def log_stats(self, interval: int = 60 * 10):
+        """
+        # Периодически пишет в лог состояние пула подключений.
+        """
+        logger = logging.getLogger("db")
+        while True:
+            await asyncio.sleep(interval)
+            logger.info(
+                " | ".join(f"{key}: {value}" for key, value in self.stats.items())
+            )
+
     async def create_all(self):
+        # Движок не закрываем: его пул подключений используют остальные менеджеры.
         async with self._engine.begin() as conn:
             await conn.run_sync(Base.metadata.create_all)
+            await conn.run_sync(run_migrations, Base.metadata)
+
+    async def dispose(self):
         await self._engine.dispose()
 
 
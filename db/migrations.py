@@ -0,0 +1,83 @@
+"""
+Изменения схемы для уже существующих таблиц.
+
+`Base.metadata.create_all` создает только отсутствующие таблицы,
+поэтому новые колонки и индексы моделей добавляются здесь.
+Все изменения можно применять повторно.
+"""
+
+import logging
+
+from sqlalchemy import inspect, text, MetaData
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import DBAPIError
+
+logger = logging.getLogger(__name__)
+
+
+def add_missing_columns(conn: Connection, metadata: MetaData) -> None:
+    """
+    # Добавляет в существующие таблицы колонки, которые появились в моделях.
+    """
+    inspector = inspect(conn)
+    preparer = conn.dialect.identifier_preparer
+
+    for table in metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+
+        existing_columns = {
+            column["name"] for column in inspector.get_columns(table.name)
+        }
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+
+            column_type = column.type.compile(dialect=conn.dialect)
+            null = "NULL" if column.nullable else "NOT NULL"
+            logger.info(f"# Миграция | Добавляем колонку {table.name}.{column.name}")
+            conn.execute(
+                text(
+                    f"ALTER TABLE {preparer.format_table(table)}"
+                    f" ADD COLUMN {preparer.format_column(column)} {column_type} {null}"
+                )
+            )
+
+
+def create_missing_indexes(conn: Connection, metadata: MetaData) -> None:
+    """
+    # Создает в существующих таблицах индексы, которые объявлены в моделях.
+
+    Если не удалось создать уникальный индекс (в таблице уже есть дубли),
+    то ошибка останавливает запуск.
+    """
+    inspector = inspect(conn)
+
+    for table in metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+
+        existing_indexes = {
+            index["name"] for index in inspector.get_indexes(table.name)
+        }
+        for index in table.indexes:
+            if index.name in existing_indexes:
+                continue
+
+            logger.info(f"# Миграция | Создаем индекс {table.name}.{index.name}")
+            try:
+                index.create(conn)
+            except DBAPIError as exc:
+                logger.error(
+                    f"# Миграция | Не удалось создать индекс {index.name}: {exc}"
+                )
+                if index.unique:
+                    # На уникальные индексы полагаются `User.upsert` и сборщик
+                    # конфигураций, без них дубли будут только копиться.
+                    # Дубли надо удалить вручную, после этого запустить заново.
+                    raise
+
+
+def run_migrations(conn: Connection, metadata: MetaData) -> None:
+    add_missing_columns(conn, metadata)
+    create_missing_indexes(conn, metadata)
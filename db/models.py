@@ -1,15 +1,26 @@
 from datetime import datetime
-from typing import TypeVar, Generic, Sequence
+from typing import TypeVar, Generic, Sequence, Iterable
 
 import flag
 from sqlalchemy.exc import NoResultFound
-from sqlalchemy.schema import ForeignKey, Column, Table
+from sqlalchemy.schema import ForeignKey, Column, Table, Index
 from sqlalchemy.types import String, DateTime, Text, Integer
-from sqlalchemy.sql import select, update as sqlalchemy_update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import (
+    select,
+    insert,
+    delete,
+    update as sqlalchemy_update,
+    or_,
+    and_,
+    func,
+)
+from sqlalchemy.dialects.mysql import insert as mysql_insert
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy.orm.strategy_options import load_only, selectinload
+from sqlalchemy.orm.strategy_options import load_only, selectinload, lazyload
 
 from .db_connector import Base, async_db_session
+from .cache import ModelCatalogCache
 
 
 T = TypeVar("T")
@@ -27,10 +38,10 @@ class ModelAdmin(Generic[T]):
         :return: Созданный объект.
         """
 
-        async with async_db_session() as session:
+        async with async_db_session.session_scope() as session:
             obj = cls(**kwargs)
             session.add(obj)
-            await session.commit()
+            await async_db_session.commit(session)
             await session.refresh(obj)
             return obj
 
@@ -41,9 +52,9 @@ class ModelAdmin(Generic[T]):
         :param kwargs: Поля и значения для объекта.
         """
 
-        async with async_db_session() as session:
+        async with async_db_session.session_scope() as session:
             session.add(cls(**kwargs))
-            await session.commit()
+            await async_db_session.commit(session)
 
     async def update(self, **kwargs) -> None:
         """
@@ -51,19 +62,37 @@ class ModelAdmin(Generic[T]):
         :param kwargs: Поля и значения, которые надо поменять.
         """
 
-        async with async_db_session() as session:
+        async with async_db_session.session_scope() as session:
             await session.execute(
                 sqlalchemy_update(self.__class__), [{"id": self.id, **kwargs}]
             )
-            await session.commit()
+            await async_db_session.commit(session)
 
     async def delete(self) -> None:
         """
         # Удаляет объект.
         """
-        async with async_db_session() as session:
+        async with async_db_session.session_scope() as session:
             await session.delete(self)
-            await session.commit()
+            await async_db_session.commit(session)
+
+    @classmethod
+    async def bulk_save(
+        cls, to_create: list[dict] = None, to_update: list[dict] = None
+    ) -> None:
+        """
+        # Добавляет и обновляет записи пачкой в одной транзакции.
+        :param to_create: Поля и значения новых объектов (один INSERT).
+        :param to_update: Поля и значения для изменения, обязательно
+         с `id` (один UPDATE).
+        """
+
+        async with async_db_session.session_scope() as session:
+            if to_create:
+                await session.execute(insert(cls), to_create)
+            if to_update:
+                await session.execute(sqlalchemy_update(cls), to_update)
+            await async_db_session.commit(session)
 
     @classmethod
     async def get(cls, select_in_load: str | None = None, **kwargs) -> T:
@@ -82,7 +111,7 @@ class ModelAdmin(Generic[T]):
             query.options(selectinload(getattr(cls, select_in_load)))
 
         try:
-            async with async_db_session() as session:
+            async with async_db_session.session_scope() as session:
                 results = await session.execute(query)
                 (result,) = results.one()
                 return result
@@ -90,11 +119,17 @@ class ModelAdmin(Generic[T]):
             raise cls.DoesNotExists
 
     @classmethod
-    async def filter(cls, select_in_load: str | None = None, **kwargs) -> Sequence[T]:
+    async def filter(
+        cls,
+        select_in_load: str | None = None,
+        values: list[str] | None = None,
+        **kwargs,
+    ) -> Sequence[T]:
         """
         # Возвращает все записи, которые удовлетворяют фильтру.
 
         :param select_in_load: Загрузить сразу связанную модель.
+        :param values: Список полей, которые надо вернуть, если нет, то все (default None).
         :param kwargs: Поля и значения.
         :return: Перечень записей.
         """
@@ -102,16 +137,41 @@ class ModelAdmin(Generic[T]):
         params = [getattr(cls, key) == val for key, val in kwargs.items()]
         query = select(cls).where(*params)
 
+        if values and isinstance(values, list):
+            # Определенные поля
+            values = [getattr(cls, val) for val in values if isinstance(val, str)]
+            query = query.options(load_only(*values))
+
         if select_in_load:
             query.options(selectinload(getattr(cls, select_in_load)))
 
         try:
-            async with async_db_session() as session:
+            async with async_db_session.session_scope() as session:
                 results = await session.execute(query)
                 return results.scalars().all()
         except NoResultFound:
             return ()
 
+    @classmethod
+    async def in_bulk(
+        cls, ids: Iterable[int], values: list[str] | None = None
+    ) -> Sequence[T]:
+        """
+        # Возвращает записи по списку идентификаторов одним запросом.
+
+        :param ids: Идентификаторы записей.
+        :param values: Список полей, которые надо вернуть, если нет, то все (default None).
+        """
+
+        query = select(cls).where(cls.id.in_(list(ids)))
+        if values and isinstance(values, list):
+            values = [getattr(cls, val) for val in values if isinstance(val, str)]
+            query = query.options(load_only(*values))
+
+        async with async_db_session.session_scope() as session:
+            result = await session.execute(query)
+            return result.scalars().all()
+
     @classmethod
     async def all(
         cls, select_in_load: str = None, values: list[str] = None
@@ -134,51 +194,54 @@ class ModelAdmin(Generic[T]):
         if select_in_load:
             query.options(selectinload(getattr(cls, select_in_load)))
 
-        async with async_db_session() as session:
+        async with async_db_session.session_scope() as session:
             result = await session.execute(query)
             return result.scalars().all()
 
 
 class User(Base, ModelAdmin):
     __tablename__ = "users"
+    __table_args__ = (Index("ux_users_tg_id", "tg_id", unique=True),)
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     tg_id: Mapped[int]
 
     active_bills: Mapped[list["ActiveBills"]] = relationship()
 
-    @classmethod
-    async def get_or_create(cls, tg_id: int) -> "User":
-        try:
-            user = await User.get(tg_id=tg_id)
-        except cls.DoesNotExists:
-            user = await User.create(tg_id=tg_id)
-        return user
+    @staticmethod
+    async def get_id(tg_id: int) -> int:
+        """
+        # Возвращает идентификатор пользователя, создает пользователя, если нет.
 
-    async def get_connections(self) -> Sequence["VPNConnection"]:
+        Существующий пользователь определяется чтением по индексу `tg_id`,
+        запись (`upsert`) выполняется только для нового пользователя.
+        """
         async with async_db_session() as session:
-            query = select(VPNConnection).where(
-                VPNConnection.user_id == self.id,
-                VPNConnection.available_to != None,
-            )
-            connections = await session.execute(query)
+            user_id = await session.scalar(select(User.id).where(User.tg_id == tg_id))
+        if user_id is None:
+            user_id = await User.upsert(tg_id)
+        return user_id
 
-        return connections.scalars().all()
+    @staticmethod
+    async def upsert(tg_id: int) -> int:
+        """
+        # Создает пользователя, если нет, одним запросом и возвращает его идентификатор.
 
-    async def get_active_bills(self) -> Sequence["ActiveBills"]:
+        `INSERT ... ON DUPLICATE KEY UPDATE` по уникальному индексу `tg_id`
+        не создаст дубликат при одновременных запросах, а `LAST_INSERT_ID(id)`
+        возвращает идентификатор и новой, и уже существующей записи.
+        Каждый вызов расходует значение AUTO_INCREMENT, поэтому для уже
+        существующих пользователей используйте `get_id`.
+        """
+        query = (
+            mysql_insert(User)
+            .values(tg_id=tg_id)
+            .on_duplicate_key_update(id=func.last_insert_id(User.id))
+        )
         async with async_db_session() as session:
-            query = (
-                select(User)
-                .where(User.tg_id == self.tg_id)
-                .options(
-                    selectinload(User.active_bills).selectinload(
-                        ActiveBills.vpn_connections
-                    )
-                )
-            )
-            user = await session.execute(query)
-
-        return user.scalars().one().active_bills
+            result = await session.execute(query)
+            await session.commit()
+        return result.lastrowid
 
 
 class Server(Base, ModelAdmin):
@@ -198,9 +261,45 @@ class Server(Base, ModelAdmin):
     def verbose_location(self) -> str:
         return f"{flag.flag(self.country_code)} {self.location}"
 
+    # При изменении серверов сбрасываем кэш `server_catalog`.
+
+    @classmethod
+    async def create(cls, **kwargs) -> "Server":
+        server = await super().create(**kwargs)
+        server_catalog.invalidate()
+        return server
+
+    @classmethod
+    async def add(cls, **kwargs) -> None:
+        await super().add(**kwargs)
+        server_catalog.invalidate()
+
+    async def update(self, **kwargs) -> None:
+        await super().update(**kwargs)
+        server_catalog.invalidate()
+
+    async def delete(self) -> None:
+        await super().delete()
+        server_catalog.invalidate()
+
 
 class VPNConnection(Base, ModelAdmin):
     __tablename__ = "vpn_connections"
+    __table_args__ = (
+        # Свободные подключения сервера (`reserve_free`).
+        Index("ix_vpn_connections_server_id_user_id", "server_id", "user_id"),
+        # Конфигурация сервера по локальному IP (сборщик конфигураций).
+        Index(
+            "ux_vpn_connections_server_id_local_ip",
+            "server_id",
+            "local_ip",
+            unique=True,
+        ),
+        # Подключения пользователя (`load_user_profile`).
+        Index("ix_vpn_connections_user_id_available_to", "user_id", "available_to"),
+        # Сроки аренды (менеджер аренды, уведомления).
+        Index("ix_vpn_connections_available_to", "available_to"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     server_id: Mapped[int] = mapped_column(ForeignKey("servers.id"))
@@ -209,10 +308,163 @@ class VPNConnection(Base, ModelAdmin):
     local_ip: Mapped[str] = mapped_column(String(15))
     available_to: Mapped[datetime] = mapped_column(nullable=True)
     config: Mapped[str] = mapped_column(Text())
+    # Хэш исходного файла на сервере и версии сборщика `config` (`stored_hash`).
+    config_hash: Mapped[str] = mapped_column(String(64), nullable=True)
     client_name: Mapped[str] = mapped_column(String(30))
 
     @staticmethod
-    async def get_free(server_id: int, limit: int):
+    async def get_rent_deadlines(
+        available_until: datetime, frozen_until: datetime
+    ) -> Sequence["VPNConnection"]:
+        """
+        # Возвращает подключения, аренду которых пора проверить.
+
+        :param available_until: Для доступных подключений - срок аренды до этой даты.
+        :param frozen_until: Для замороженных подключений - срок аренды до этой даты.
+        """
+        async with async_db_session() as session:
+            query = (
+                select(VPNConnection)
+                .where(
+                    or_(
+                        and_(
+                            VPNConnection.available.is_(True),
+                            VPNConnection.available_to <= available_until,
+                        ),
+                        VPNConnection.available_to <= frozen_until,
+                    )
+                )
+                .options(
+                    load_only(
+                        VPNConnection.id,
+                        VPNConnection.available,
+                        VPNConnection.available_to,
+                    )
+                )
+            )
+            res = await session.execute(query)
+            return res.scalars().all()
+
+    @staticmethod
+    async def lock_rent(
+        session: AsyncSession, ids: Iterable[int]
+    ) -> Sequence["VPNConnection"]:
+        """
+        # Блокирует подключения до конца транзакции переданной сессии.
+
+        Оплата и заморозка меняют подключение сначала на сервере, а затем в базе.
+        Блокировка строк на время обеих операций не дает им перемешаться,
+        а срок аренды читается уже после блокировки.
+        """
+        res = await session.execute(
+            select(VPNConnection)
+            .where(VPNConnection.id.in_(list(ids)))
+            .order_by(VPNConnection.id)
+            .options(
+                load_only(
+                    VPNConnection.id,
+                    VPNConnection.server_id,
+                    VPNConnection.local_ip,
+                    VPNConnection.available,
+                    VPNConnection.available_to,
+                )
+            )
+            .with_for_update()
+        )
+        return res.scalars().all()
+
+    @staticmethod
+    async def get_server_state(
+        server_id: int,
+    ) -> tuple[Sequence["VPNConnection"], set[int]]:
+        """
+        # Возвращает подключения сервера и идентификаторы подключений со счетом.
+
+        Счет, который сейчас обрабатывается, еще виден другим транзакциям,
+        пока не зафиксировано удаление счета вместе с продлением подключений.
+        """
+        async with async_db_session() as session:
+            res = await session.execute(
+                select(VPNConnection)
+                .where(VPNConnection.server_id == server_id)
+                .options(
+                    load_only(
+                        VPNConnection.id,
+                        VPNConnection.local_ip,
+                        VPNConnection.user_id,
+                        VPNConnection.available,
+                        VPNConnection.available_to,
+                    )
+                )
+            )
+            connections = res.scalars().all()
+            billed_ids = await session.scalars(
+                select(bills_vpn_connections_association_table.c.vpn_conn_id)
+                .join(
+                    VPNConnection,
+                    VPNConnection.id
+                    == bills_vpn_connections_association_table.c.vpn_conn_id,
+                )
+                .where(VPNConnection.server_id == server_id)
+            )
+            return connections, set(billed_ids)
+
+    @staticmethod
+    async def get_expiring(
+        until: datetime,
+    ) -> Sequence[tuple["VPNConnection", User, "Server"]]:
+        """
+        # Возвращает арендованные подключения вместе с пользователем и сервером.
+
+        Только подключения, которые уже заморожены или аренда которых
+        закончится до `until`.
+        """
+        async with async_db_session() as session:
+            query = (
+                select(VPNConnection, User, Server)
+                .join(User, VPNConnection.user_id == User.id)
+                .join(Server, VPNConnection.server_id == Server.id)
+                .where(
+                    VPNConnection.available_to.is_not(None),
+                    or_(
+                        VPNConnection.available.is_(False),
+                        VPNConnection.available_to <= until,
+                    ),
+                )
+                .options(
+                    load_only(
+                        VPNConnection.id,
+                        VPNConnection.available,
+                        VPNConnection.available_to,
+                        VPNConnection.local_ip,
+                    ),
+                    lazyload(Server.vpn_connections),
+                )
+            )
+            res = await session.execute(query)
+            return res.tuples().all()
+
+    class NotEnoughFree(Exception):
+        def __init__(self, available: int):
+            super().__init__(f"Свободных подключений: {available}")
+            self.available = available
+
+    @staticmethod
+    async def reserve_free(
+        server_id: int, user_id: int, limit: int
+    ) -> Sequence["VPNConnection"]:
+        """
+        # Бронирует за пользователем свободные подключения сервера.
+
+        Выбор и бронирование выполняются в одной транзакции, выбранные строки
+        блокируются (`FOR UPDATE`), а заблокированные другими покупателями
+        пропускаются (`SKIP LOCKED`), поэтому одновременные покупки
+        не получат одни и те же подключения и не ждут друг друга.
+
+        :param limit: Сколько подключений забронировать.
+        :return: Забронированные подключения, либо вызовет исключение
+         NotEnoughFree, если свободных меньше `limit` (тогда ничего не бронируется).
+        """
         async with async_db_session() as session:
             query = (
                 select(VPNConnection)
@@ -220,9 +472,24 @@ class VPNConnection(Base, ModelAdmin):
                 .where(VPNConnection.user_id.is_(None))
                 .options(load_only(VPNConnection.id))
                 .limit(limit)
+                .with_for_update(skip_locked=True)
             )
-            res = await session.execute(query)
-            return res.scalars()
+            connections = (await session.execute(query)).scalars().all()
+
+            if len(connections) < limit:
+                await session.rollback()
+                raise VPNConnection.NotEnoughFree(len(connections))
+
+            # На время оплаты подключения замораживаются, чтобы их не заняли другие.
+            await session.execute(
+                sqlalchemy_update(VPNConnection),
+                [
+                    {"id": conn.id, "user_id": user_id, "available": False}
+                    for conn in connections
+                ],
+            )
+            await session.commit()
+            return connections
 
 
 bills_vpn_connections_association_table = Table(
@@ -235,6 +502,7 @@ bills_vpn_connections_association_table = Table(
 
 class ActiveBills(Base, ModelAdmin):
     __tablename__ = "active_bills"
+    __table_args__ = (Index("ux_active_bills_bill_id", "bill_id", unique=True),)
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     bill_id: Mapped[str] = mapped_column(String(255))
@@ -255,9 +523,33 @@ class ActiveBills(Base, ModelAdmin):
         """
         # Удаляет объект.
         """
-        async with async_db_session() as session:
+        async with async_db_session.session_scope() as session:
             active_bill = await session.get(ActiveBills, self.id)
             for conn in active_bill.vpn_connections:
                 active_bill.vpn_connections.remove(conn)
             await session.delete(active_bill)
-            await session.commit()
+            await async_db_session.commit(session)
+
+    @staticmethod
+    async def claim(session: AsyncSession, id: int) -> bool:
+        """
+        # Удаляет счет в транзакции переданной сессии.
+
+        :return: True, если счет был удален именно этой транзакцией,
+         False, если его уже удалили (обработали) ранее.
+        """
+        await session.execute(
+            delete(bills_vpn_connections_association_table).where(
+                bills_vpn_connections_association_table.c.bill_id == id
+            )
+        )
+        result = await session.execute(
+            delete(ActiveBills)
+            .where(ActiveBills.id == id)
+            .execution_options(synchronize_session=False)
+        )
+        return result.rowcount == 1
+
+
+# Серверы меняются редко, а нужны почти в каждом обработчике.
+server_catalog: ModelCatalogCache[Server] = ModelCatalogCache(Server)
@@ -0,0 +1,148 @@
+"""
+Данные профиля пользователя для отображения в боте.
+
+Пользователь, неоплаченные счета с их подключениями, одна страница
+подключений пользователя и их общее кол-во загружаются тремя запросами,
+серверы берутся из `server_catalog`.
+Подключения разбиты на страницы по идентификатору (keyset), поэтому
+время загрузки не зависит от кол-ва подключений у пользователя.
+Результат - простые объекты без связи с сессией базы.
+"""
+
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from sqlalchemy.orm.strategy_options import joinedload
+from sqlalchemy.sql import func, select
+
+from .db_connector import async_db_session
+from .models import ActiveBills, Server, User, VPNConnection, server_catalog
+
+
+@dataclass(frozen=True)
+class ProfileConnection:
+    id: int
+    server_id: int
+    local_ip: str
+    available: bool
+    available_to: datetime | None
+
+
+@dataclass(frozen=True)
+class ProfileBill:
+    id: int
+    type: str
+    rent_month: int
+    pay_url: str
+    available_to: datetime | None
+    connection_ids: tuple[int, ...]
+    # Сервер первого подключения счета.
+    server_id: int | None
+
+
+@dataclass
+class ProfileData:
+    user_id: int
+    # Подключения текущей страницы.
+    connections: list[ProfileConnection] = field(default_factory=list)
+    bills: list[ProfileBill] = field(default_factory=list)
+    servers: dict[int, Server] = field(default_factory=dict)
+    # Всего подключений у пользователя.
+    total_connections: int = 0
+    has_prev_page: bool = False
+    has_next_page: bool = False
+
+
+async def load_user_profile(
+    user_id: int,
+    page_size: int = 10,
+    after_id: int | None = None,
+    before_id: int | None = None,
+) -> ProfileData:
+    """
+    # Загружает данные профиля пользователя.
+
+    :param page_size: Кол-во подключений на странице.
+    :param after_id: Страница подключений после этого идентификатора.
+    :param before_id: Страница подключений до этого идентификатора.
+     Если не указаны ни `after_id`, ни `before_id`, то первая страница.
+    """
+    async with async_db_session() as session:
+        result = await session.execute(
+            select(User)
+            .where(User.id == user_id)
+            .options(
+                joinedload(User.active_bills)
+                .joinedload(ActiveBills.vpn_connections)
+                .load_only(VPNConnection.id, VPNConnection.server_id)
+            )
+        )
+        user = result.unique().scalar_one_or_none()
+        if user is None:
+            return ProfileData(user_id=user_id)
+
+        user_connections = (
+            VPNConnection.user_id == user.id,
+            VPNConnection.available_to != None,
+        )
+        total_connections = await session.scalar(
+            select(func.count(VPNConnection.id)).where(*user_connections)
+        )
+
+        # Подключения страницы без текста конфигурации.
+        # Загружаем на одно больше, чтобы понять, есть ли следующая страница.
+        query = (
+            select(
+                VPNConnection.id,
+                VPNConnection.server_id,
+                VPNConnection.local_ip,
+                VPNConnection.available,
+                VPNConnection.available_to,
+            )
+            .where(*user_connections)
+            .limit(page_size + 1)
+        )
+        if before_id is not None:
+            query = query.where(VPNConnection.id < before_id).order_by(
+                VPNConnection.id.desc()
+            )
+        else:
+            if after_id is not None:
+                query = query.where(VPNConnection.id > after_id)
+            query = query.order_by(VPNConnection.id)
+
+        connections = [ProfileConnection(*row) for row in await session.execute(query)]
+        has_more = len(connections) > page_size
+        connections = connections[:page_size]
+
+        if before_id is not None:
+            connections.reverse()
+            has_prev_page, has_next_page = has_more, True
+        else:
+            has_prev_page, has_next_page = after_id is not None, has_more
+
+        bills = [
+            ProfileBill(
+                id=bill.id,
+                type=bill.type,
+                rent_month=bill.rent_month,
+                pay_url=bill.pay_url,
+                available_to=bill.available_to,
+                connection_ids=tuple(conn.id for conn in bill.vpn_connections),
+                server_id=(
+                    bill.vpn_connections[0].server_id if bill.vpn_connections else None
+                ),
+            )
+            for bill in user.active_bills
+        ]
+
+    servers = {server.id: server for server in await server_catalog.all()}
+    return ProfileData(
+        user_id=user.id,
+        connections=connections,
+        bills=bills,
+        servers=servers,
+        total_connections=total_connections,
+        has_prev_page=has_prev_page,
+        has_next_page=has_next_page,
+    )
@@ -0,0 +1,90 @@
+"""
+Проверка планов выполнения частых запросов.
+
+Для каждого запроса выполняется `EXPLAIN` и выводится индекс, который выбрал MySQL.
+Запуск:
+
+    python -m db.query_plans
+
+На почти пустых таблицах MySQL может предпочесть полный просмотр таблицы,
+поэтому проверять имеет смысл на базе с реальными данными.
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy.sql import Select, select, or_, and_
+
+from .db_connector import async_db_session
+from .models import User, VPNConnection
+
+
+def hot_queries() -> dict[str, Select]:
+    """
+    # Запросы с теми же условиями, что и в моделях, менеджерах и обработчиках.
+    """
+    now = datetime.now()
+    return {
+        # Пользователь для обработчиков (`User.get_id`).
+        "users.tg_id": select(User).where(User.tg_id == 0),
+        # `VPNConnection.reserve_free`.
+        "vpn_connections.reserve_free": (
+            select(VPNConnection.id)
+            .where(VPNConnection.server_id == 0)
+            .where(VPNConnection.user_id.is_(None))
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        ),
+        # Сборщик конфигураций.
+        "vpn_connections.server_id+local_ip": select(VPNConnection.id).where(
+            VPNConnection.server_id == 0, VPNConnection.local_ip == "10.66.66.2"
+        ),
+        # `load_user_profile`.
+        "vpn_connections.user_id+available_to": select(VPNConnection.id).where(
+            VPNConnection.user_id == 0, VPNConnection.available_to != None
+        ),
+        # `VPNConnection.get_rent_deadlines`.
+        "vpn_connections.available_to": select(VPNConnection.id).where(
+            or_(
+                and_(
+                    VPNConnection.available.is_(True),
+                    VPNConnection.available_to <= now,
+                ),
+                VPNConnection.available_to <= now - timedelta(days=5),
+            )
+        ),
+    }
+
+
+async def explain_hot_queries() -> dict[str, list[dict]]:
+    """
+    # Выполняет `EXPLAIN` для частых запросов.
+    :return: Словарь {название запроса: строки плана выполнения}.
+    """
+    plans = {}
+    async with async_db_session() as session:
+        conn = await session.connection()
+        for name, query in hot_queries().items():
+            compiled = query.compile(
+                dialect=conn.dialect, compile_kwargs={"render_postcompile": True}
+            )
+            # aiomysql использует позиционные параметры (`%s`),
+            # значения передаются кортежем в порядке их появления в запросе.
+            params = tuple(compiled.params[key] for key in compiled.positiontup)
+            result = await conn.exec_driver_sql(f"EXPLAIN {compiled}", params)
+            plans[name] = [dict(row) for row in result.mappings()]
+    return plans
+
+
+async def main():
+    for name, plan in (await explain_hot_queries()).items():
+        for row in plan:
+            status = "OK" if row.get("key") else "FULL SCAN"
+            print(
+                f"{status:<10} {name:<40} key={row.get('key')}"
+                f" type={row.get('type')} rows={row.get('rows')}"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
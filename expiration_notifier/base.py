@@ -1,18 +1,30 @@
 from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Literal
 
 from db import VPNConnection, User, Server
 
 
-class AbstractNotifier(ABC):
+@dataclass
+class ExpirationNotice:
+    """
+    Уведомление об одном подключении пользователя.
 
-    @abstractmethod
-    async def notify_connection_expired(
-        self, user: User, server: Server, connection: VPNConnection, days_left: int
-    ):
-        pass
+     - mode - "connection_expired" (аренда вышла) или "soon_expired" (скоро выйдет).
+     - days_left - дней до удаления, либо до окончания аренды.
+    """
+
+    mode: Literal["connection_expired", "soon_expired"]
+    server: Server
+    connection: VPNConnection
+    days_left: int
+
+
+class AbstractNotifier(ABC):
 
     @abstractmethod
-    async def notify_soon_expired(
-        self, user: User, server: Server, connection: VPNConnection, days_left: int
-    ):
+    async def notify_user(self, user: User, notices: list[ExpirationNotice]):
+        """
+        Отправляет пользователю одно уведомление обо всех его подключениях.
+        """
         pass
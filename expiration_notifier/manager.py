@@ -1,19 +1,21 @@
 import asyncio
+import logging
 from datetime import datetime, timedelta, time, date
-from typing import Literal
 
-from db import VPNConnection, User, Server
-from db.models import ModelAdmin
-from .base import AbstractNotifier
+from db import VPNConnection, User
+from .base import AbstractNotifier, ExpirationNotice
 
 
 class ExpirationManager:
     expiration_limit_timedelta = timedelta(days=5)
     notifier_time = time(hour=19, minute=31, second=0)
+    # Сколько пользователей уведомляем одновременно.
+    max_concurrent_notifications = 20
 
     def __init__(self, notifiers: list[AbstractNotifier]):
         self._notifiers = notifiers
         self._last_day_checked: date = date.today() - timedelta(days=1)
+        self.logger = logging.getLogger(self.__class__.__name__)
 
     async def run(self):
         while True:
@@ -32,47 +34,49 @@ class ExpirationManager:
         )
 
     async def _check_vpn_connections(self):
-        for conn in await VPNConnection.all():
-            conn: VPNConnection
-
-            if not conn.user_id or not conn.available_to:
-                continue
+        now = datetime.now()
+        # Уведомления, сгруппированные по пользователям.
+        users_notices: dict[int, tuple[User, list[ExpirationNotice]]] = {}
 
+        for conn, user, server in await VPNConnection.get_expiring(
+            until=now + self.expiration_limit_timedelta
+        ):
             if not conn.available:
                 # Если подключение уже недоступно, но еще принадлежит пользователю
                 days_to_delete = (
-                    (conn.available_to + self.expiration_limit_timedelta)
-                    - datetime.now()
+                    (conn.available_to + self.expiration_limit_timedelta) - now
                 ).days
+                notice = ExpirationNotice(
+                    "connection_expired", server, conn, days_to_delete
+                )
 
-                await self._notify("connection_expired", conn, days_to_delete)
-
-            elif conn.available_to <= datetime.now() + self.expiration_limit_timedelta:
+            else:
                 # Если подключение скоро истечет
-                days_left = (conn.available_to - datetime.now()).days
-
-                await self._notify("soon_expired", conn, days_left)
+                days_left = (conn.available_to - now).days
+                notice = ExpirationNotice("soon_expired", server, conn, days_left)
 
-    @staticmethod
-    async def get_user_and_server(conn: VPNConnection) -> tuple[User, Server]:
-        user: User = await User.get(id=conn.user_id)
-        server: Server = await Server.get(id=conn.server_id)
+            users_notices.setdefault(user.id, (user, []))[1].append(notice)
 
-        return user, server
+        semaphore = asyncio.Semaphore(self.max_concurrent_notifications)
+        await asyncio.gather(
+            *(
+                self._notify(user, notices, semaphore)
+                for user, notices in users_notices.values()
+            )
+        )
 
     async def _notify(
         self,
-        mode: Literal["connection_expired", "soon_expired"],
-        conn: VPNConnection,
-        days_to_delete,
+        user: User,
+        notices: list[ExpirationNotice],
+        semaphore: asyncio.Semaphore,
     ):
-        try:
-            user, server = await self.get_user_and_server(conn)
-        except ModelAdmin.DoesNotExists:
-            return
-
-        else:
+        async with semaphore:
             for notifier in self._notifiers:
-                await getattr(notifier, f"notify_{mode}")(
-                    user, server, conn, days_to_delete
-                )
+                try:
+                    await notifier.notify_user(user, notices)
+                except Exception as exc:
+                    self.logger.error(
+                        f"# Пользователь {user.id:<5} | Ошибка уведомления {exc}",
+                        exc_info=exc,
+                    )
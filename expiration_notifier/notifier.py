@@ -1,37 +1,119 @@
+import logging
+
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramRetryAfter,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+)
+
 from db import VPNConnection, User, Server
-from .base import AbstractNotifier
+from .base import AbstractNotifier, ExpirationNotice
+from helpers.rate_limit import TokenBucket
 from helpers.verbose_numbers import days_verbose
 
 
 class TgBotNotifier(AbstractNotifier):
+    # Telegram позволяет отправлять около 30 сообщений в секунду.
+    messages_per_second = 25
+    max_retries = 3
+    # Ограничение Telegram на длину сообщения.
+    max_message_length = 4096
+
     def __init__(self, bot):
         self.bot = bot
+        self._rate_limiter = TokenBucket(rate=self.messages_per_second)
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    async def notify_user(self, user: User, notices: list[ExpirationNotice]):
+        for part in self._split_notices(notices):
+            text = "\n\n".join(text for _, text in part)
+            if not await self._send_message(chat_id=user.tg_id, text=text):
+                self.logger.error(
+                    f"# Пользователь {user.id:<5} | Уведомление не отправлено | "
+                    + ", ".join(
+                        f"{notice.mode} {notice.connection.local_ip}"
+                        for notice, _ in part
+                    )
+                )
+
+    def _split_notices(
+        self, notices: list[ExpirationNotice]
+    ) -> list[list[tuple[ExpirationNotice, str]]]:
+        """
+        # Разбивает уведомления на сообщения не длиннее `max_message_length`.
+        Уведомление об одном подключении не разрывается между сообщениями.
+        """
+        parts = []
+        part = []
+        length = 0
+        for notice in notices:
+            text = getattr(self, f"_{notice.mode}_text")(
+                notice.server, notice.connection, notice.days_left
+            )
+            # Уведомления разделяются пустой строкой.
+            added_length = len(text) + (2 if part else 0)
+            if part and length + added_length > self.max_message_length:
+                parts.append(part)
+                part, length, added_length = [], 0, len(text)
+            part.append((notice, text))
+            length += added_length
+        if part:
+            parts.append(part)
+        return parts
+
+    async def _send_message(self, chat_id: int, text: str) -> bool:
+        """
+        # Отправляет сообщение, повторяя попытку при превышении лимита и ошибке сети.
+        :return: False, если сообщение не удалось отправить за `max_retries` попыток,
+         либо Telegram отклонил запрос.
+        """
+        for _ in range(self.max_retries):
+            await self._rate_limiter.acquire()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text)
+                return True
+            except TelegramRetryAfter as exc:
+                # Превысили лимит Telegram - все отправки ждут, сколько он просит.
+                self._rate_limiter.pause(exc.retry_after)
+            except TelegramNetworkError as exc:
+                self.logger.warning(f"# Пользователь {chat_id} | Ошибка сети {exc}")
+            except TelegramForbiddenError:
+                # Пользователь заблокировал бота.
+                self.logger.info(f"# Пользователь {chat_id} | Бот заблокирован")
+                return True
+            except TelegramBadRequest as exc:
+                # Повтор того же запроса завершится той же ошибкой.
+                self.logger.warning(f"# Пользователь {chat_id} | Ошибка запроса {exc}")
+                return False
+        return False
 
-    async def notify_connection_expired(
-        self, user: User, server: Server, connection: VPNConnection, days_left: int
-    ):
+    @staticmethod
+    def _connection_expired_text(
+        server: Server, connection: VPNConnection, days_left: int
+    ) -> str:
         if days_left == 0:
             days_left_string = "Удалится завтра"
         else:
             days_left_string = f"Удалится через {days_left} {days_verbose(days_left)}"
 
-        await self.bot.send_message(
-            chat_id=user.tg_id,
-            text=f"Срок аренды вышел!\n"
-            f"Подключение {connection.local_ip}\n{server.name}{server.verbose_location}\n"
-            f"{days_left_string}",
+        return (
+            f"Срок аренды вышел!\n"
+            f"Подключение {connection.local_ip}\n"
+            f"{server.name}{server.verbose_location}\n"
+            f"{days_left_string}"
         )
 
-    async def notify_soon_expired(
-        self, user: User, server: Server, connection: VPNConnection, days_left: int
-    ):
+    @staticmethod
+    def _soon_expired_text(
+        server: Server, connection: VPNConnection, days_left: int
+    ) -> str:
         if days_left == 0:
             days_left_string = "Завтра"
         else:
             days_left_string = f"Через {days_left} {days_verbose(days_left)}"
 
-        await self.bot.send_message(
-            chat_id=user.tg_id,
-            text=f"{days_left_string} закончится аренда подключения!"
-            f" {connection.local_ip}\n{server.name}{server.verbose_location}",
+        return (
+            f"{days_left_string} закончится аренда подключения!"
+            f" {connection.local_ip}\n{server.name}{server.verbose_location}"
         )
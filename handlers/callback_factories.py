@@ -82,3 +82,17 @@ class GetConfigCallbackFactory(CallbackData, prefix="config"):
      - connection_id
     """
     connection_id: int
+
+
+class ProfilePageCallbackFactory(CallbackData, prefix="profile_page"):
+    """
+    Используется для перехода по страницам подключений в профиле.
+
+    Класс содержит атрибуты:
+     - number (int) - порядковый номер первого подключения на странице.
+     - after_id (int) - опционально, показать подключения после этого идентификатора.
+     - before_id (int) - опционально, показать подключения до этого идентификатора.
+    """
+    number: int
+    after_id: int | None
+    before_id: int | None
@@ -32,7 +32,7 @@ async def payment_answer(callback: CallbackQuery, data: dict):
 
 @router.callback_query(ConfirmPaymentCF.filter(F.type_ == "new"))
 async def create_bill_for_new_rent(
-    callback: CallbackQuery, callback_data: ConfirmPaymentCF
+    callback: CallbackQuery, callback_data: ConfirmPaymentCF, user: User
 ):
     """
     СОЗДАНИЕ ФОРМЫ ОПЛАТЫ НА QIWI | КУПИТЬ НОВЫЕ ПОДКЛЮЧЕНИЯ
@@ -41,8 +41,6 @@ async def create_bill_for_new_rent(
     keyboard = InlineKeyboardBuilder()
     keyboard.add(InlineKeyboardButton(text="🔝 Назад", callback_data="start"))
 
-    user = await User.get_or_create(tg_id=callback.from_user.id)
-
     if not callback_data.server_id:
         await callback.message.edit_text(
             "❗️Вы не выбрали VPN сервер для подключения❗️",
@@ -51,44 +49,28 @@ async def create_bill_for_new_rent(
         await callback.answer()
         return
 
-    # Получаем свободные подключения на данном сервере в необходимом кол-ве.
-    free_connection = list(
-        await VPNConnection.get_free(
-            server_id=callback_data.server_id, limit=callback_data.count
-        )
-    )
-
-    # Если нет свободных подключений на этом сервере
-    if not free_connection:
-        await callback.message.edit_text(
-            "☹️ Извините, на данном сервере подключения закончились, пожалуйста, выберите другой",
-            reply_markup=keyboard.as_markup(),
-        )
-        await callback.answer()
-        return
-    if len(free_connection) < callback_data.count:
-        await callback.message.edit_text(
-            f"☹️ Извините, на выбранном сервере недостаточно свободных подключений,"
-            f' осталось: "{len(free_connection)}"\n',
-            reply_markup=keyboard.as_markup(),
+    # Бронируем свободные подключения на данном сервере в необходимом кол-ве.
+    try:
+        free_connection = list(
+            await VPNConnection.reserve_free(
+                server_id=callback_data.server_id,
+                user_id=user.id,
+                limit=callback_data.count,
+            )
         )
+    except VPNConnection.NotEnoughFree as exc:
+        if not exc.available:
+            # Если нет свободных подключений на этом сервере
+            text = "☹️ Извините, на данном сервере подключения закончились, пожалуйста, выберите другой"
+        else:
+            text = (
+                f"☹️ Извините, на выбранном сервере недостаточно свободных подключений,"
+                f' осталось: "{exc.available}"\n'
+            )
+        await callback.message.edit_text(text, reply_markup=keyboard.as_markup())
         await callback.answer()
         return
 
-    # На время оплаты указанное пользователем кол-во устройств необходимо заморозить, чтобы не заняли другие
-    async with async_db_session() as session:
-        await session.execute(
-            update(VPNConnection),
-            [
-                {"id": conn.id, "user_id": user.id, "available": False}
-                for conn in free_connection
-            ],
-        )
-        await session.commit()
-
-    # Пользователь
-    user = await User.get_or_create(tg_id=callback.from_user.id)
-
     qiwi_payment = QIWIPayment()
     if data := await qiwi_payment.create_bill(value=callback_data.cost):
         # Добавляем счет об оплате
@@ -122,7 +104,7 @@ async def create_bill_for_new_rent(
 
 @router.callback_query(ConfirmPaymentCF.filter(F.type_ == "extend"))
 async def create_bill_for_exist_rent(
-    callback: CallbackQuery, callback_data: ConfirmPaymentCF
+    callback: CallbackQuery, callback_data: ConfirmPaymentCF, user: User
 ):
     """
     СОЗДАНИЕ ФОРМЫ ОПЛАТЫ НА QIWI | ПРОДЛИТЬ АРЕНДУ ПОДКЛЮЧЕНИЯ
@@ -135,8 +117,6 @@ async def create_bill_for_exist_rent(
         )
     )
 
-    user = await User.get_or_create(tg_id=callback.from_user.id)
-
     if not callback_data.connection_id:
         await callback.message.edit_text(
             f"❗️Вы не выбрали подключение❗️",
@@ -1,8 +1,7 @@
 from aiogram import Router
-from aiogram.types import Message, InlineKeyboardButton, CallbackQuery
-from aiogram.utils.keyboard import InlineKeyboardBuilder
+from aiogram.types import Message, CallbackQuery
 
-from db import Server
+from .keyboards import welcome_keyboard, back_keyboard, countries_text
 
 router = Router()
 
@@ -40,18 +39,7 @@ async def welcome(message_type):
 
 <b>📝 Не пишем логи 🗑</b>
     """
-    keyboard = InlineKeyboardBuilder()
-    keyboard.row(
-        InlineKeyboardButton(text="🌍 Доступные страны", callback_data="show_countries"),
-        InlineKeyboardButton(text="❔ Как пользоваться", callback_data="how_to_use"),
-    )
-    keyboard.row(
-        InlineKeyboardButton(
-            text="💱 Купить подключение", callback_data="choose_location"
-        )
-    )
-    keyboard.row(InlineKeyboardButton(text="🔹 Профиль 🔹", callback_data="show_profile"))
-    await message_type(text, reply_markup=keyboard.as_markup())
+    await message_type(text, reply_markup=welcome_keyboard())
 
 
 @router.callback_query(text="how_to_use")
@@ -72,9 +60,7 @@ async def how_to_use(call: CallbackQuery):
 3️⃣ Открываем приложение и добавляем скачанный файл
 
 """
-    keyboard = InlineKeyboardBuilder()
-    keyboard.add(InlineKeyboardButton(text="🔙 Назад", callback_data="start"))
-    await call.message.edit_text(text, reply_markup=keyboard.as_markup())
+    await call.message.edit_text(text, reply_markup=back_keyboard("start"))
 
 
 @router.callback_query(text="show_countries")
@@ -83,17 +69,8 @@ async def show_countries(callback: CallbackQuery):
     Список доступных стран
     """
 
-    countries = ""
-    # Смотрим список VPN серверов
-    for server in await Server.all(values=["country_code", "location"]):
-        # Добавляем флаг страны и местоположение VPN сервера
-        countries += server.verbose_location + "\n"
-
-    keyboard = InlineKeyboardBuilder(
-        [[InlineKeyboardButton(text="🔙 Назад", callback_data="start")]]
-    )
     await callback.message.edit_text(
-        text="Список стран\n" + countries,
-        reply_markup=keyboard.as_markup(),
+        text="Список стран\n" + await countries_text(),
+        reply_markup=back_keyboard("start"),
     )
     await callback.answer()
@@ -0,0 +1,157 @@
+"""
+Готовые клавиатуры для часто открываемых меню.
+
+Разметка собирается один раз и затем переиспользуется без повторной упаковки
+callback данных. Клавиатуры, которые зависят от списка серверов,
+пересобираются при смене версии `server_catalog`.
+"""
+
+from functools import lru_cache
+
+import flag
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+from db import Server, server_catalog
+from .callback_factories import (
+    DeviceCountCallbackFactory as DevCountCF,
+    BuyCallbackFactory as BuyCF,
+)
+
+# Периоды аренды по строкам клавиатуры: (кол-во месяцев, подпись, множитель цены).
+RENT_PERIODS = (
+    ((1, "1️⃣ месяц", 1), (2, "2️⃣ месяца", 1)),
+    ((3, "3️⃣ месяца", 1), (4, "4️⃣ месяца", 1)),
+    ((5, "5️⃣ месяцев", 1),),
+    ((6, "6️⃣ месяцев 🔸 -20% 🔸", 0.8),),
+    ((12, "1️⃣ год 🔹 -30% 🔹", 0.7),),
+)
+
+
+@lru_cache(maxsize=None)
+def welcome_keyboard() -> InlineKeyboardMarkup:
+    keyboard = InlineKeyboardBuilder()
+    keyboard.row(
+        InlineKeyboardButton(text="🌍 Доступные страны", callback_data="show_countries"),
+        InlineKeyboardButton(text="❔ Как пользоваться", callback_data="how_to_use"),
+    )
+    keyboard.row(
+        InlineKeyboardButton(
+            text="💱 Купить подключение", callback_data="choose_location"
+        )
+    )
+    keyboard.row(InlineKeyboardButton(text="🔹 Профиль 🔹", callback_data="show_profile"))
+    return keyboard.as_markup()
+
+
+@lru_cache(maxsize=None)
+def back_keyboard(
+    callback_data: str = "start", text: str = "🔙 Назад"
+) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        inline_keyboard=[[InlineKeyboardButton(text=text, callback_data=callback_data)]]
+    )
+
+
+async def choose_location_keyboard() -> InlineKeyboardMarkup:
+    servers = await server_catalog.all()
+    return _choose_location_keyboard(server_catalog.version, servers)
+
+
+@lru_cache(maxsize=1)
+def _choose_location_keyboard(
+    catalog_version: int, servers: tuple[Server, ...]
+) -> InlineKeyboardMarkup:
+    keyboard = InlineKeyboardBuilder()
+    for server in servers:
+        # Добавляем флаг страны и местоположение VPN сервера
+        text = flag.flagize(
+            f":{server.country_code}: {server.location}\n", subregions=True
+        )
+        keyboard.add(
+            InlineKeyboardButton(
+                text=text, callback_data=DevCountCF(count=1, server_id=server.id).pack()
+            )
+        )
+    return keyboard.as_markup()
+
+
+async def countries_text() -> str:
+    servers = await server_catalog.all()
+    return _countries_text(server_catalog.version, servers)
+
+
+@lru_cache(maxsize=1)
+def _countries_text(catalog_version: int, servers: tuple[Server, ...]) -> str:
+    return "".join(server.verbose_location + "\n" for server in servers)
+
+
+@lru_cache(maxsize=1024)
+def period_rows(
+    type_: str,
+    base_cost: int,
+    server_id: int,
+    count: int | None = None,
+    connection_id: int | None = None,
+) -> tuple[tuple[InlineKeyboardButton, ...], ...]:
+    """
+    Кнопки выбора периода оплаты.
+    """
+    return tuple(
+        tuple(
+            InlineKeyboardButton(
+                text=f"{label} - {round(base_cost * month * discount)} ₽",
+                callback_data=BuyCF(
+                    type_=type_,
+                    month=month,
+                    cost=round(base_cost * month * discount),
+                    server_id=server_id,
+                    count=count,
+                    connection_id=connection_id,
+                ).pack(),
+            )
+            for month, label, discount in row
+        )
+        for row in RENT_PERIODS
+    )
+
+
+@lru_cache(maxsize=256)
+def new_rent_keyboard(count: int, server_id: int) -> InlineKeyboardMarkup:
+    """
+    Выбор кол-ва подключений и периода аренды.
+    """
+    keyboard = InlineKeyboardBuilder()
+    if count > 1:
+        keyboard.row(
+            InlineKeyboardButton(
+                text="➖ Убрать одно устройство",
+                callback_data=DevCountCF(count=count - 1, server_id=server_id).pack(),
+            )
+        )
+    if count < 4:
+        keyboard.row(
+            InlineKeyboardButton(
+                text="➕ Добавить еще одно устройство",
+                callback_data=DevCountCF(count=count + 1, server_id=server_id).pack(),
+            )
+        )
+
+    for row in period_rows("new", 50 + 100 * count, server_id, count=count):
+        keyboard.row(*row)
+
+    keyboard.row(InlineKeyboardButton(text="🔝 На главную", callback_data="start"))
+    return keyboard.as_markup()
+
+
+@lru_cache(maxsize=1024)
+def extend_rent_keyboard(connection_id: int, server_id: int) -> InlineKeyboardMarkup:
+    """
+    Выбор периода продления аренды подключения.
+    """
+    keyboard = InlineKeyboardBuilder()
+    for row in period_rows("extend", 150, server_id, connection_id=connection_id):
+        keyboard.row(*row)
+
+    keyboard.add(InlineKeyboardButton(text="✖️Отмена", callback_data="show_profile"))
+    return keyboard.as_markup()
@@ -4,36 +4,53 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from helpers.bot_answers_shortcuts import send_technical_error
 from .callback_factories import ExtendRentCallbackFactory as ExtendRentCF
-from db import VPNConnection, ActiveBills, User, Server
+from db import (
+    VPNConnection,
+    User,
+    Server,
+    server_catalog,
+    load_user_profile,
+    ProfileData,
+    ProfileConnection,
+    ProfileBill,
+)
 from .buy_service import month_verbose
 from .callback_factories import GetConfigCallbackFactory as GetConfigCF
+from .callback_factories import ProfilePageCallbackFactory as ProfilePageCF
 
 router = Router()
 
+# Кол-во подключений на одной странице профиля.
+PAGE_SIZE = 10
+
 
 class UserProfile:
     """
     Для управления пользовательским профилем и просмотром состояния его подключений.
     """
 
-    def __init__(self, user: User):
-        self._user = user
+    def __init__(self, profile: ProfileData, first_number: int = 1):
+        self._profile = profile
+        # Порядковый номер первого подключения на странице.
+        self._first_number = first_number
 
         # Доступные пользователю VPN подключения
-        self._vpn_connections: list[VPNConnection] = []
+        self._vpn_connections: list[ProfileConnection] = profile.connections
 
         # Текущие неоплаченные счета
-        self._active_bills: list[ActiveBills] = []
+        self._active_bills: list[ProfileBill] = profile.bills
+        # Есть ли у пользователя хотя бы один неоплаченный счет.
+        self._has_pending_bills = bool(profile.bills)
+        # Счет на продление для каждого подключения (первый найденный).
+        self._extend_bills: dict[int, ProfileBill] = {}
+        for bill in profile.bills:
+            if bill.type == "extend":
+                for connection_id in bill.connection_ids:
+                    self._extend_bills.setdefault(connection_id, bill)
 
         self._keyboard = InlineKeyboardBuilder()
         self._text_lines = []
 
-    async def collect_vpn_connections(self):
-        self._vpn_connections = await self._user.get_connections()
-
-    async def collect_active_bills(self):
-        self._active_bills = await self._user.get_active_bills()
-
     def get_keyboard(self) -> InlineKeyboardBuilder:
         """
         Возвращает набор кнопок для отправки.
@@ -47,7 +64,7 @@ class UserProfile:
         """
         return "\n".join(self._text_lines)
 
-    async def create_profile(self) -> None:
+    def create_profile(self) -> None:
         """
         Создаем информацию о профиле пользователя.
         """
@@ -55,12 +72,12 @@ class UserProfile:
             self._create_empty_user_profile()
 
         else:
-            await self._create_new_active_bills_info_text()
-            await self._create_text_and_add_buttons_for_users_connections()
+            self._create_new_active_bills_info_text()
+            self._create_text_and_add_buttons_for_users_connections()
             self._add_button_to_start()
 
     def _user_has_no_data(self) -> bool:
-        return not len(self._vpn_connections) and not len(self._active_bills)
+        return not self._profile.total_connections and not self._has_pending_bills
 
     def _create_empty_user_profile(self) -> None:
         self._keyboard.row(
@@ -72,39 +89,38 @@ class UserProfile:
     def _add_button_to_start(self):
         self._keyboard.row(InlineKeyboardButton(text="🔙 Назад", callback_data="start"))
 
-    async def _create_new_active_bills_info_text(self) -> None:
+    def _create_new_active_bills_info_text(self) -> None:
         """
         Создает описание для новых счетов ожидающих подключение.
         """
         for bill in self._active_bills:
             if bill.type == "new":
-                try:
-                    server = await Server.get(id=bill.vpn_connections[0].server_id)
-                except Server.DoesNotExists:
+                server = self._profile.servers.get(bill.server_id)
+                if server is None:
                     continue
 
                 self._text_lines.append(
                     f"⏳ Ожидается оплата:\n"
                     f"На длительность {bill.rent_month} {month_verbose(bill.rent_month)} "
                     f"{server.verbose_location}\n"
-                    f"Количество устройств: {len(bill.vpn_connections)}\n"
+                    f"Количество устройств: {len(bill.connection_ids)}\n"
                     f'<a href="{bill.pay_url}">Форма оплаты</a>'
                     f' доступна до {bill.available_to.strftime("%H:%M:%S")}\n'
                 )
 
-    async def _create_text_and_add_buttons_for_users_connections(self) -> None:
+    def _create_text_and_add_buttons_for_users_connections(self) -> None:
         """
         Создает информацию обо всех подключениях имеющихся у пользователя.
         """
         self._text_lines.append(
-            f"\nУ вас имеется: {len(self._vpn_connections)} подключений\n"
+            f"\nУ вас имеется: {self._profile.total_connections} подключений\n"
         )
 
-        # Смотрим по очереди подключения
-        for i, connection in enumerate(self._vpn_connections, 1):
+        # Смотрим по очереди подключения текущей страницы
+        for i, connection in enumerate(self._vpn_connections, self._first_number):
             buttons_row: list[InlineKeyboardButton] = []
 
-            await self._create_info_for_connection(
+            self._create_info_for_connection(
                 connection, conn_number=i, buttons_row=buttons_row
             )
 
@@ -116,9 +132,42 @@ class UserProfile:
                 # Формируем кнопки для данного подключения
                 self._keyboard.row(*buttons_row)
 
-    async def _create_info_for_connection(
+        self._add_page_buttons()
+
+    def _add_page_buttons(self) -> None:
+        """
+        Кнопки перехода на предыдущую и следующую страницы подключений.
+        """
+        if not self._vpn_connections:
+            return
+
+        buttons_row: list[InlineKeyboardButton] = []
+        if self._profile.has_prev_page:
+            buttons_row.append(
+                InlineKeyboardButton(
+                    text="⬅️",
+                    callback_data=ProfilePageCF(
+                        number=max(self._first_number - PAGE_SIZE, 1),
+                        before_id=self._vpn_connections[0].id,
+                    ).pack(),
+                )
+            )
+        if self._profile.has_next_page:
+            buttons_row.append(
+                InlineKeyboardButton(
+                    text="➡️",
+                    callback_data=ProfilePageCF(
+                        number=self._first_number + len(self._vpn_connections),
+                        after_id=self._vpn_connections[-1].id,
+                    ).pack(),
+                )
+            )
+        if buttons_row:
+            self._keyboard.row(*buttons_row)
+
+    def _create_info_for_connection(
         self,
-        connection: VPNConnection,
+        connection: ProfileConnection,
         conn_number: int,
         buttons_row: list[InlineKeyboardButton],
     ) -> None:
@@ -130,9 +179,8 @@ class UserProfile:
         """
 
         # Определяем местоположение подключения
-        try:
-            server = await Server.get(id=connection.server_id)
-        except Server.DoesNotExists:
+        server = self._profile.servers.get(connection.server_id)
+        if server is None:
             return
 
         # Информация подключения (состояние)
@@ -154,20 +202,17 @@ class UserProfile:
 
     def _create_text_for_extended_connection(
         self,
-        connection: VPNConnection,
+        connection: ProfileConnection,
         conn_number: int,
         buttons_row: list[InlineKeyboardButton],
     ) -> None:
         # Имеется ли информация о продлении данного подключения
-        for bill in self._active_bills:
-            conn_ids = [conn.id for conn in bill.vpn_connections]
-            if bill.type == "extend" and connection.id in conn_ids:
-                self._text_lines.append(
-                    f"Вы уже запросили продление услуги на {bill.rent_month} {month_verbose(bill.rent_month)}\n"
-                    f' <a href="{bill.pay_url}">Форма оплаты</a>'
-                    f' доступна до {bill.available_to.strftime("%H:%M:%S")}'
-                )
-                break
+        if bill := self._extend_bills.get(connection.id):
+            self._text_lines.append(
+                f"Вы уже запросили продление услуги на {bill.rent_month} {month_verbose(bill.rent_month)}\n"
+                f' <a href="{bill.pay_url}">Форма оплаты</a>'
+                f' доступна до {bill.available_to.strftime("%H:%M:%S")}'
+            )
         else:
             self._create_button_for_extend(
                 connection, conn_number=conn_number, buttons_row=buttons_row
@@ -175,11 +220,11 @@ class UserProfile:
 
     def _create_button_for_extend(
         self,
-        connection: VPNConnection,
+        connection: ProfileConnection,
         conn_number: int,
         buttons_row: list[InlineKeyboardButton],
     ) -> None:
-        if not len(self._active_bills):
+        if not self._has_pending_bills:
             # Формируем callback data для продления услуги VPN
             extend_rent_callback = ExtendRentCF(
                 connection_id=connection.id,
@@ -196,14 +241,11 @@ class UserProfile:
             )
 
 
-@router.callback_query(text="show_profile")
-async def show_profile(callback: CallbackQuery):
-    user = await User.get_or_create(tg_id=callback.from_user.id)
-
-    user_profile = UserProfile(user)
-    await user_profile.collect_vpn_connections()
-    await user_profile.collect_active_bills()
-    await user_profile.create_profile()
+async def send_profile(
+    callback: CallbackQuery, profile: ProfileData, first_number: int = 1
+):
+    user_profile = UserProfile(profile, first_number=first_number)
+    user_profile.create_profile()
 
     await callback.message.edit_text(
         text=user_profile.get_text(),
@@ -212,15 +254,33 @@ async def show_profile(callback: CallbackQuery):
     await callback.answer()
 
 
-@router.callback_query(GetConfigCF.filter())
-async def get_user_config(callback: CallbackQuery, callback_data: GetConfigCF):
-    try:
-        user = await User.get(tg_id=callback.from_user.id)
-    except User.DoesNotExists:
-        # Не существует пользователя
-        await send_technical_error(callback, "❗️У вас нет доступных конфигурации❗️")
+@router.callback_query(text="show_profile")
+async def show_profile(callback: CallbackQuery, user: User):
+    profile = await load_user_profile(user_id=user.id, page_size=PAGE_SIZE)
+    await send_profile(callback, profile)
+
+
+@router.callback_query(ProfilePageCF.filter())
+async def show_profile_page(
+    callback: CallbackQuery, callback_data: ProfilePageCF, user: User
+):
+    profile = await load_user_profile(
+        user_id=user.id,
+        page_size=PAGE_SIZE,
+        after_id=callback_data.after_id,
+        before_id=callback_data.before_id,
+    )
+    if not profile.connections and profile.total_connections:
+        # Подключения страницы уже освобождены - показываем первую страницу.
+        await show_profile(callback, user)
         return
+    await send_profile(callback, profile, first_number=callback_data.number)
+
 
+@router.callback_query(GetConfigCF.filter())
+async def get_user_config(
+    callback: CallbackQuery, callback_data: GetConfigCF, user: User
+):
     try:
         # Смотрим запрашиваемое подключение
         connection: VPNConnection = await VPNConnection.get(
@@ -236,7 +296,7 @@ async def get_user_config(callback: CallbackQuery, callback_data: GetConfigCF):
         return
 
     try:
-        server = await Server.get(id=connection.server_id)
+        server = await server_catalog.get(connection.server_id)
     except Server.DoesNotExists:
         await send_technical_error(callback, "❗Сервер больше не существует❗️")
         return
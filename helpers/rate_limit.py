@@ -0,0 +1,64 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты запросов («ведро токенов»).
+
+    Пополняется на `rate` токенов в секунду, но накапливает не больше `capacity`.
+    Каждый запрос забирает один токен, а если токенов нет - ждет.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """
+        # Запрещает запросы на `seconds` секунд (например, после ответа 429).
+        """
+        self._refill()
+        self._tokens = min(self._tokens, 0) - seconds * self.rate
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated_at) * self.rate
+        )
+        self._updated_at = now
+
+
+class AdaptiveTokenBucket(TokenBucket):
+    """
+    Ведро токенов, которое подстраивает частоту под ответы сервиса:
+    при ответе 429 частота уменьшается вдвое, а при успешных ответах
+    постепенно возвращается к `max_rate`.
+    """
+
+    def __init__(self, rate: float, min_rate: float, recover_step: float = 0.1):
+        super().__init__(rate)
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.recover_step = recover_step
+
+    def backoff(self, retry_after: float | None = None) -> None:
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.capacity = max(1.0, self.rate)
+        self.pause(retry_after if retry_after is not None else 1 / self.rate)
+
+    def recover(self) -> None:
+        self.rate = min(self.max_rate, self.rate + self.recover_step)
+        self.capacity = max(1.0, self.rate)
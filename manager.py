@@ -2,16 +2,43 @@ import asyncio
 import logging
 
 from db import async_db_session
-from server_manager.managers import ConfigManager, PaymentManager, VPNControlManager
+from payment.qiwi_payment import QIWIPayment
+from server_manager import ServerConnectionPool
+from server_manager.managers import (
+    ConfigManager,
+    FrozenStateReconciler,
+    PaymentManager,
+    VPNControlManager,
+    RentExpiryScheduler,
+)
 
 
 async def main():
-    await asyncio.gather(
-        asyncio.Task(async_db_session.create_all(), name="create_db_tables"),
-        asyncio.Task(ConfigManager().run(), name="config_manager"),
-        asyncio.Task(VPNControlManager().run(), name="vpn_connections_manager"),
-        asyncio.Task(PaymentManager().run(), name="payment_manager"),
-    )
+    # Одно SSH подключение на сервер для всех менеджеров.
+    ssh_pool = ServerConnectionPool()
+    # Общая очередь сроков аренды: оплата обновляет сроки для заморозки.
+    rent_scheduler = RentExpiryScheduler()
+    try:
+        await asyncio.gather(
+            asyncio.Task(async_db_session.create_all(), name="create_db_tables"),
+            asyncio.Task(async_db_session.log_stats(), name="db_stats"),
+            asyncio.Task(ssh_pool.run(), name="ssh_pool"),
+            asyncio.Task(ConfigManager(ssh_pool).run(), name="config_manager"),
+            asyncio.Task(
+                VPNControlManager(ssh_pool, rent_scheduler).run(),
+                name="vpn_connections_manager",
+            ),
+            asyncio.Task(
+                PaymentManager(ssh_pool, rent_scheduler).run(), name="payment_manager"
+            ),
+            asyncio.Task(
+                FrozenStateReconciler(ssh_pool).run(), name="frozen_state_reconciler"
+            ),
+        )
+    finally:
+        await ssh_pool.close()
+        await QIWIPayment.close_session()
+        await async_db_session.dispose()
 
 
 if __name__ == "__main__":
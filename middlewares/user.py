@@ -0,0 +1,54 @@
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, User as TgUser
+
+from db import User
+
+
+class UserMiddleware(BaseMiddleware):
+    """
+    Определяет пользователя базы по Telegram ID один раз на событие
+    и передает его в обработчики через аргумент `user`.
+
+    Идентификаторы пользователей хранятся в кэше на `ttl` секунд, не более
+    `maxsize` записей, давно не использованные вытесняются первыми.
+    Каждое событие получает свой объект `User` без сессии базы, в нем
+    заполнены только `id` и `tg_id`.
+    Отсутствующий пользователь создается одним запросом (`User.get_id`).
+    """
+
+    def __init__(self, maxsize: int = 10_000, ttl: int = 60 * 10):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # tg_id -> (идентификатор пользователя, время окончания хранения)
+        self._cache: OrderedDict[int, tuple[int, float]] = OrderedDict()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        tg_user: TgUser | None = data.get("event_from_user")
+        if tg_user is not None:
+            user_id = await self.get_user_id(tg_user.id)
+            data["user"] = User(id=user_id, tg_id=tg_user.id)
+        return await handler(event, data)
+
+    async def get_user_id(self, tg_id: int) -> int:
+        now = time.monotonic()
+        if cached := self._cache.get(tg_id):
+            user_id, expires_at = cached
+            if expires_at > now:
+                self._cache.move_to_end(tg_id)
+                return user_id
+
+        user_id = await User.get_id(tg_id)
+        self._cache[tg_id] = (user_id, now + self.ttl)
+        self._cache.move_to_end(tg_id)
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+        return user_id
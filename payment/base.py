@@ -1,7 +1,22 @@
 from abc import ABC, abstractmethod
+from typing import Mapping
 
 
 class AbstractPayment(ABC):
+    class TooManyRequests(Exception):
+        """
+        Платежная система ограничила частоту запросов.
+        """
+
+        def __init__(self, retry_after: float | None = None):
+            super().__init__(f"Too many requests, retry after {retry_after}")
+            self.retry_after = retry_after
+
+    class InvalidNotification(Exception):
+        """
+        Уведомление о платеже не прошло проверку подписи или имеет неверный формат.
+        """
+
     @abstractmethod
     def create_bill(self, *args, **kwargs):
         pass
@@ -9,3 +24,11 @@ class AbstractPayment(ABC):
     @abstractmethod
     def check_bill_status(self, *args, **kwargs):
         pass
+
+    @abstractmethod
+    def parse_notification(self, payload: dict, headers: Mapping[str, str]):
+        """
+        Проверяет подпись уведомления о платеже.
+        :return: Кортеж (идентификатор счета, статус счета).
+        """
+        pass
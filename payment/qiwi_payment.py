@@ -1,6 +1,9 @@
+import hashlib
+import hmac
 import os
 import uuid
 from datetime import datetime, timedelta, timezone
+from typing import Mapping
 
 import aiohttp
 
@@ -9,6 +12,13 @@ from .base import AbstractPayment
 
 class QIWIPayment(AbstractPayment):
     _token = os.getenv("QIWI_TOKEN")
+    # Можно указать адрес локального тестового сервера вместо QIWI.
+    base_url = os.getenv("QIWI_API_URL", "https://api.qiwi.com/partner/bill/v1/bills")
+    signature_header = "X-Api-Signature-SHA256"
+
+    # Одна HTTP сессия (и пул соединений) на процесс для всех запросов к QIWI.
+    _session: aiohttp.ClientSession | None = None
+    max_connections = 10
 
     def __init__(self, currency="RUB", expiration_minutes=10):
         self.currency = currency
@@ -16,34 +26,82 @@ class QIWIPayment(AbstractPayment):
         current_time = datetime.now().astimezone(timezone(offset))
         self.available_to = current_time + timedelta(minutes=expiration_minutes)
 
-    async def create_bill(self, value: int) -> dict:
-        async with aiohttp.ClientSession() as session:
-            response = await session.put(
-                url=f"https://api.qiwi.com/partner/bill/v1/bills/{uuid.uuid4()}",
+    @classmethod
+    def _get_session(cls) -> aiohttp.ClientSession:
+        if cls._session is None or cls._session.closed:
+            cls._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=cls.max_connections),
                 headers={
                     "accept": "application/json",
-                    "Authorization": f"Bearer {self._token}",
-                },
-                json={
-                    "amount": {"currency": self.currency, "value": value},
-                    "comment": "Axo VPN",
-                    "expirationDateTime": f"{self.available_to.strftime('%Y-%m-%dT%H:%M:%S+03:00')}",
+                    "Authorization": f"Bearer {cls._token}",
                 },
+                timeout=aiohttp.ClientTimeout(total=10),
             )
-        if response.status == 200:
-            return await response.json()
+        return cls._session
+
+    @classmethod
+    async def close_session(cls) -> None:
+        if cls._session is not None:
+            await cls._session.close()
+            cls._session = None
+
+    async def create_bill(self, value: int) -> dict:
+        async with self._get_session().put(
+            url=f"{self.base_url}/{uuid.uuid4()}",
+            json={
+                "amount": {"currency": self.currency, "value": value},
+                "comment": "Axo VPN",
+                "expirationDateTime": f"{self.available_to.strftime('%Y-%m-%dT%H:%M:%S+03:00')}",
+            },
+        ) as response:
+            if response.status == 200:
+                return await response.json()
 
         return {}
 
     async def check_bill_status(self, bill_id: str) -> str | None:
-        async with aiohttp.ClientSession() as session:
-            response = await session.get(
-                url=f"https://api.qiwi.com/partner/bill/v1/bills/{bill_id}",
-                headers={
-                    "accept": "application/json",
-                    "Authorization": f"Bearer {self._token}",
-                },
-            )
-        if response.status == 200:
-            result = await response.json()
-            return result["status"]["value"]
+        session = self._get_session()
+        async with session.get(url=f"{self.base_url}/{bill_id}") as response:
+            if response.status == 200:
+                result = await response.json()
+                return result["status"]["value"]
+
+            if response.status == 429:
+                retry_after = response.headers.get("Retry-After", "")
+                raise self.TooManyRequests(
+                    float(retry_after) if retry_after.isdigit() else None
+                )
+
+    @classmethod
+    def sign_notification(cls, bill: dict) -> str:
+        """
+        Подпись уведомления QIWI: HMAC-SHA256 секретным ключом от строки
+        `amount.currency|amount.value|billId|siteId|status.value`.
+        """
+        message = "|".join(
+            [
+                bill["amount"]["currency"],
+                bill["amount"]["value"],
+                bill["billId"],
+                bill["siteId"],
+                bill["status"]["value"],
+            ]
+        )
+        return hmac.new(
+            cls._token.encode(), message.encode(), hashlib.sha256
+        ).hexdigest()
+
+    def parse_notification(
+        self, payload: dict, headers: Mapping[str, str]
+    ) -> tuple[str, str]:
+        try:
+            bill = payload["bill"]
+            expected_signature = self.sign_notification(bill)
+        except (KeyError, TypeError, AttributeError) as exc:
+            raise self.InvalidNotification(f"Неверный формат уведомления: {exc}")
+
+        signature = headers.get(self.signature_header, "")
+        if not hmac.compare_digest(signature, expected_signature):
+            raise self.InvalidNotification("Неверная подпись уведомления")
+
+        return bill["billId"], bill["status"]["value"]
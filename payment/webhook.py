@@ -0,0 +1,57 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+from aiohttp import web
+
+from .base import AbstractPayment
+
+
+class PaymentNotificationHandler:
+    """
+    Принимает уведомления платежной системы об изменении статуса счета.
+
+    Подпись уведомления проверяется, после чего счет сразу передается
+    в `on_notification(bill_id, status)`. Ответ платежной системе отправляется,
+    не дожидаясь активации подключений.
+    """
+
+    def __init__(
+        self,
+        payment: AbstractPayment,
+        on_notification: Callable[[str, str], Awaitable[None]],
+    ):
+        self._payment = payment
+        self._on_notification = on_notification
+        self._tasks: set[asyncio.Task] = set()
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def register(self, app: web.Application, path: str) -> None:
+        app.router.add_post(path, self.handle)
+        app.on_shutdown.append(self._wait_tasks)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        try:
+            payload = await request.json()
+        except ValueError:
+            return web.json_response({"error": "1"}, status=400)
+
+        try:
+            bill_id, status = self._payment.parse_notification(
+                payload, request.headers
+            )
+        except self._payment.InvalidNotification as exc:
+            self.logger.warning(f"Уведомление о платеже отклонено: {exc}")
+            return web.json_response({"error": "1"}, status=403)
+
+        self.logger.info(f"Уведомление о платеже | Счет {bill_id} | Статус {status}")
+
+        task = asyncio.create_task(self._on_notification(bill_id, status))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+        return web.json_response({"error": "0"})
+
+    async def _wait_tasks(self, app: web.Application) -> None:
+        if self._tasks:
+            await asyncio.wait(self._tasks)
@@ -1,2 +1,2 @@
-from .server import ServerConnection
+from .server import ServerConnection, ServerConnectionPool
 from .configuration import ConfigBuilder
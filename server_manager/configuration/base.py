@@ -1,3 +1,4 @@
+import hashlib
 import re
 from abc import ABC, abstractmethod
 from dataclasses import dataclass, field
@@ -18,6 +19,11 @@ class Config:
     def config_text(self):
         return "\n".join(self.rows)
 
+    @property
+    def fingerprint(self) -> str:
+        """SHA-256 исходного текста конфигурации, совпадает с `sha256sum` файла"""
+        return hashlib.sha256(self.config_text.encode()).hexdigest()
+
 
 class BaseConfigBuilder(ABC):
     default_allowed_ips = [
@@ -55,9 +61,29 @@ class BaseConfigBuilder(ABC):
         "::/0",
     ]
 
+    # Увеличить при изменении `create_config`, чтобы сборщик конфигураций
+    # обновил в базе все конфигурации, даже если файлы на серверах не менялись.
+    format_version = 1
+
     def __init__(self, config: str, name: str = ""):
         self.config = self._parse_config(config, name)
 
+    @classmethod
+    def stored_hash(cls, file_hash: str) -> str:
+        """
+        Хэш для сравнения с базой: SHA-256 файла вместе с версией формата
+        и списком AllowedIPs, которые `create_config` подставляет в конфигурацию.
+        """
+        source = ":".join(
+            [
+                cls.__name__,
+                str(cls.format_version),
+                ",".join(cls.default_allowed_ips),
+                file_hash,
+            ]
+        )
+        return hashlib.sha256(source.encode()).hexdigest()
+
     @staticmethod
     def _parse_config(config_text: str, name: str) -> Config:
         rows = config_text.split("\n")
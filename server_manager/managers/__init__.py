@@ -1,3 +1,5 @@
 from .config_manager import ConfigManager
 from .payment_control import PaymentManager
 from .vpn_control_manager import VPNControlManager
+from .scheduler import RentExpiryScheduler
+from .reconciler import FrozenStateReconciler
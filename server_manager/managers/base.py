@@ -1,12 +1,89 @@
+import asyncio
 import logging
+import time
 from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, Iterable, TypeVar
+
+from asyncssh import DisconnectError
+
+from db import Server
+from ..server import ServerConnection, ServerConnectionPool
+
+R = TypeVar("R")
 
 
 class BaseManager(ABC):
     timeout: int = 60
+    # Сколько серверов обрабатываем одновременно (`for_each_server`).
+    max_concurrent_servers: int = 10
+    # Максимальное время обработки одного сервера (секунды).
+    server_deadline: int = 60
 
-    def __init__(self):
+    def __init__(self, ssh_pool: ServerConnectionPool | None = None):
         self.logger = logging.getLogger(self.__class__.__name__)
+        # Общий для всех менеджеров пул SSH подключений к серверам.
+        self.ssh_pool = ssh_pool or ServerConnectionPool()
+
+    async def connect_to_server(self, server: Server) -> ServerConnection:
+        """
+        # Возвращает подключение к серверу через общий пул SSH подключений.
+        """
+        sc = ServerConnection(server, pool=self.ssh_pool)
+        await sc.connect()
+        return sc
+
+    async def for_each_server(
+        self,
+        servers: Iterable[Server],
+        handler: Callable[[Server], Awaitable[R]],
+        title: str,
+    ) -> list[R | None]:
+        """
+        # Обрабатывает серверы одновременно, но не более `max_concurrent_servers`
+        # сразу и не дольше `server_deadline` секунд каждый.
+
+        Ошибка одного сервера не влияет на остальные.
+        :param title: Название обработки для лога.
+        :return: Результаты `handler` в порядке серверов, None для серверов с ошибкой.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrent_servers)
+
+        async def process(server: Server) -> R | None:
+            async with semaphore:
+                started = time.monotonic()
+                try:
+                    return await asyncio.wait_for(
+                        handler(server), timeout=self.server_deadline
+                    )
+                except Exception as exc:
+                    self.invalidate_on_connection_error(server.id, exc)
+                    self.logger.error(
+                        f"{title} | Сервер {server.name} | Ошибка {exc}",
+                        exc_info=exc,
+                    )
+                    return None
+                finally:
+                    self.logger.info(
+                        f"# Сервер: {server.name:<15} | "
+                        f"Обработан за {time.monotonic() - started:.2f}с"
+                    )
+
+        return await asyncio.gather(*(process(server) for server in servers))
+
+    def invalidate_on_connection_error(self, server_id: int, exc: BaseException):
+        """
+        # Закрывает SSH подключение к серверу, если ошибка означает его обрыв.
+
+        Подключение общее для всех менеджеров, поэтому превышение времени
+        обработки или ошибка команды его не закрывают: по нему могут
+        выполняться команды других менеджеров.
+        """
+        if isinstance(exc, asyncio.TimeoutError):
+            # В Python 3.11 это подкласс OSError.
+            return
+        if isinstance(exc, (OSError, DisconnectError)):
+            # Подключение к серверу оборвалось, в следующий раз создадим новое.
+            self.ssh_pool.invalidate(server_id)
 
     @abstractmethod
     async def task(self):
@@ -1,15 +1,16 @@
 import asyncio
+import time
 
-from db import Server, VPNConnection
+from db import Server, VPNConnection, server_catalog
 from .base import BaseManager
 from ..configuration.base import BaseConfigBuilder
-from ..server import ServerConnection
 
 
 class ConfigManager(BaseManager):
     """Сборщик VPN конфигураций"""
 
     timeout = 60 * 10
+    server_deadline = 60 * 2
 
     async def run(self):
         print("=== Запущен сборщик VPN конфигураций ===")
@@ -18,69 +19,122 @@ class ConfigManager(BaseManager):
             await asyncio.sleep(self.timeout)
 
     async def task(self):
-        for server in await Server.all():
-            self.logger.info(f"Смотрим сервер {server.name} {server.location}")
-            try:
-                config_files = await self._get_server_config_files(server)
-
-                for config_manager in config_files:
-                    if not config_manager.config.client_ip_v4:
-                        continue
-
-                    # Пытаемся найти в базе текущую конфигурацию
-                    try:
-                        connection = await VPNConnection.get(
-                            server_id=server.id,
-                            local_ip=config_manager.config.client_ip_v4,
-                        )
-                        # Если нашли конфигурацию, то проверяем её с текущей на сервере.
-                        if connection.config != config_manager.create_config():
-                            await self._update_connection(
-                                server, connection, config_manager
-                            )
-
-                    except VPNConnection.DoesNotExists:
-                        await self._create_new_connection(server, config_manager)
-
-            except Exception as exc:
-                self.logger.error(
-                    f"Сборщик VPN конфигураций | Сервер {server.name} | Ошибка {exc}",
-                    exc_info=exc,
+        servers = await server_catalog.all()
+
+        started = time.monotonic()
+        await self.for_each_server(
+            servers, self._sweep_server, title="Сборщик VPN конфигураций"
+        )
+        self.logger.info(
+            f"Сборщик VPN конфигураций | Серверов: {len(servers)}"
+            f" | Общее время: {time.monotonic() - started:.2f}с"
+        )
+
+    async def _sweep_server(self, server: Server):
+        self.logger.info(f"Смотрим сервер {server.name} {server.location}")
+
+        # Все подключения сервера одним запросом, по локальному IP.
+        # Сам текст конфигурации не загружаем, сравниваем только хэши.
+        connections: dict[str, VPNConnection] = {
+            conn.local_ip: conn
+            for conn in await VPNConnection.filter(
+                server_id=server.id,
+                values=["id", "local_ip", "client_name", "config_hash"],
+            )
+        }
+        known_hashes = {
+            conn.client_name: conn.config_hash for conn in connections.values()
+        }
+
+        config_files = await self._get_server_config_files(server, known_hashes)
+
+        to_create: list[dict] = []
+        to_update: list[dict] = []
+        created_ips: set[str] = set()
+        for config_manager in config_files:
+            local_ip = config_manager.config.client_ip_v4
+            if not local_ip:
+                continue
+
+            config_hash = config_manager.stored_hash(config_manager.config.fingerprint)
+            connection = connections.get(local_ip)
+
+            if connection is None:
+                # Если в базе нет такой конфигурации, то добавляем
+                if local_ip not in created_ips:
+                    to_create.append(
+                        self._new_connection_values(server, config_manager, config_hash)
+                    )
+                    created_ips.add(local_ip)
+
+            elif connection.config_hash != config_hash:
+                # Если они отличаются, значит надо изменить конфиг в базе.
+                to_update.append(
+                    self._updated_connection_values(
+                        server, connection, config_manager, config_hash
+                    )
                 )
 
-    @staticmethod
-    async def _get_server_config_files(server: Server) -> list[BaseConfigBuilder]:
-        sc = ServerConnection(server)
-        await sc.connect()
+        if to_create or to_update:
+            await VPNConnection.bulk_save(to_create=to_create, to_update=to_update)
+
+    async def _get_server_config_files(
+        self, server: Server, known_hashes: dict[str, str]
+    ) -> list[BaseConfigBuilder]:
+        """
+        Собирает с сервера только те конфигурации, хэш которых отличается
+        от сохраненного в базе.
+        В базе хранится не сам файл, а результат `create_config`, поэтому хэш
+        файла сравнивается вместе с версией сборщика (`stored_hash`):
+        после ее изменения конфигурации пересобираются без изменения файлов.
+        :param known_hashes: Словарь {имя файла: хэш} из базы.
+        """
+        sc = await self.connect_to_server(server)
+
+        remote_hashes = await sc.collect_config_hashes(folder="/root")
+        changed_files = [
+            file_name
+            for file_name, file_hash in remote_hashes.items()
+            if known_hashes.get(file_name) != sc.config_builder.stored_hash(file_hash)
+        ]
+        if not changed_files:
+            return []
 
         # Собираем с сервера конфигурации
-        await sc.collect_configs(folder="/root")
+        await sc.collect_configs(folder="/root", names=changed_files)
         return sc.config_files
 
-    async def _create_new_connection(
-        self, server: Server, config_manager: BaseConfigBuilder
-    ):
-        # Если в базе нет такой конфигурации, то добавляем
+    def _new_connection_values(
+        self, server: Server, config_manager: BaseConfigBuilder, config_hash: str
+    ) -> dict:
         self.logger.info(
             f"# Север: {server.name:<15} | "
             f"Добавляем конфигурацию для {config_manager.config.client_ip_v4}"
         )
-        await VPNConnection.add(
-            server_id=server.id,
-            user_id=None,
-            available=False,
-            local_ip=config_manager.config.client_ip_v4,
-            available_to=None,
-            config=config_manager.create_config(),
-            client_name=config_manager.config.name,
-        )
+        return {
+            "server_id": server.id,
+            "user_id": None,
+            "available": False,
+            "local_ip": config_manager.config.client_ip_v4,
+            "available_to": None,
+            "config": config_manager.create_config(),
+            "config_hash": config_hash,
+            "client_name": config_manager.config.name,
+        }
 
-    async def _update_connection(
-        self, server: Server, conn: VPNConnection, config_manager: BaseConfigBuilder
-    ):
+    def _updated_connection_values(
+        self,
+        server: Server,
+        conn: VPNConnection,
+        config_manager: BaseConfigBuilder,
+        config_hash: str,
+    ) -> dict:
         self.logger.info(
-            f"# Север: {server.name:<15} | "
-            f"Изменяем конфигурацию для {config_manager.config.client_ip_v4}"
+            f"# Север: {server.name:<15} | Изменяем конфигурацию для {conn.local_ip}"
         )
-        # Если они отличаются, значит надо изменить конфиг в базе.
-        await conn.update(config=config_manager.create_config())
+        return {
+            "id": conn.id,
+            "config": config_manager.create_config(),
+            "config_hash": config_hash,
+            "client_name": config_manager.config.name,
+        }
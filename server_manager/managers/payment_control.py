@@ -1,19 +1,43 @@
 import asyncio
+import os
+from collections import defaultdict
 from datetime import datetime, timedelta
+from itertools import chain
 
 from payment.base import AbstractPayment
 from payment.qiwi_payment import QIWIPayment
-from db import ActiveBills, VPNConnection, Server
-from ..server import ServerConnection
+from helpers.rate_limit import AdaptiveTokenBucket
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db import ActiveBills, VPNConnection, Server, server_catalog, async_db_session
+from ..server import ServerConnectionPool
 from .base import BaseManager
+from .scheduler import RentExpiryScheduler
 
 
 class PaymentManager(BaseManager):
-    timeout = 10
+    # При приеме уведомлений о платежах проверка статусов - запасной вариант,
+    # и ее можно делать реже.
+    timeout = int(os.getenv("PAYMENT_POLL_INTERVAL", 10))
     payment_class: AbstractPayment = QIWIPayment
 
-    def __init__(self):
-        super().__init__()
+    # Ограничения запросов к платежной системе.
+    requests_per_second = 2
+    min_requests_per_second = 0.1
+    max_concurrent_requests = 5
+
+    def __init__(
+        self,
+        ssh_pool: ServerConnectionPool | None = None,
+        rent_scheduler: RentExpiryScheduler | None = None,
+    ):
+        super().__init__(ssh_pool)
+        # Очередь сроков аренды, в которой надо обновить срок после оплаты.
+        self.rent_scheduler = rent_scheduler
+        self._rate_limiter = AdaptiveTokenBucket(
+            rate=self.requests_per_second, min_rate=self.min_requests_per_second
+        )
         self._qiwi = self.payment_class(currency="RUB")
 
     async def run(self):
@@ -27,7 +51,15 @@ class PaymentManager(BaseManager):
             select_in_load="vpn_connections"
         )
 
-        for bill in all_bills:
+        semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        await asyncio.gather(
+            *(self._processing_bill_safe(bill, semaphore) for bill in all_bills)
+        )
+
+    async def _processing_bill_safe(
+        self, bill: ActiveBills, semaphore: asyncio.Semaphore
+    ):
+        async with semaphore:
             try:
                 await self._processing_bill(bill)
             except Exception as exc:
@@ -35,68 +67,148 @@ class PaymentManager(BaseManager):
                     f"Обработчик QIWI платежей | Счет {bill} | Ошибка {exc}",
                     exc_info=exc,
                 )
-                await asyncio.sleep(5)
 
     async def _processing_bill(self, bill: ActiveBills):
-        status = await self._qiwi.check_bill_status(bill.bill_id)
-        print(status)
-
-        if status is None:
-            # Слишком много запросов на QIWI
-            await asyncio.sleep(10)
+        # Ограничиваем частоту запросов на QIWI
+        await self._rate_limiter.acquire()
+        try:
+            status = await self._qiwi.check_bill_status(bill.bill_id)
+        except self.payment_class.TooManyRequests as exc:
+            # Слишком много запросов на QIWI - снижаем частоту.
+            self._rate_limiter.backoff(exc.retry_after)
+            self.logger.info(
+                f"Обработчик QIWI платежей | Слишком много запросов,"
+                f" частота снижена до {self._rate_limiter.rate:.2f} в секунду"
+            )
+            return
+
+        self._rate_limiter.recover()
+        await self._apply_bill_status(bill, status)
+
+    async def process_bill_status(self, bill_id: str, status: str):
+        """
+        # Обрабатывает статус счета, полученный из уведомления платежной системы.
+        :param bill_id: Идентификатор счета в платежной системе.
+        :param status: Статус счета.
+        """
+        try:
+            bill = await ActiveBills.get(bill_id=bill_id)
+        except ActiveBills.DoesNotExists:
+            # Счет уже обработан.
+            return
+
+        try:
+            await self._apply_bill_status(bill, status)
+        except Exception as exc:
+            # Счет останется в базе и будет обработан при следующей проверке.
+            self.logger.error(
+                f"Уведомление о платеже | Счет {bill_id} | Ошибка {exc}",
+                exc_info=exc,
+            )
 
-        # Счет отклонен или истек срок действия формы и это новое подключение.
-        elif status in ["REJECTED", "EXPIRED"]:
-            if bill.type == "new":
-                await self._reject_bill(bill)
-            else:
-                await bill.delete()
+    async def _apply_bill_status(self, bill: ActiveBills, status: str | None):
+        # Счет отклонен или истек срок действия формы.
+        if status in ["REJECTED", "EXPIRED"]:
+            await self._reject_bill(bill)
 
         # Счет был оплачен
         elif status == "PAID":
-            await self._activate_connections(bill)
-            await bill.delete()
-
-        # Задержка перед запросами на QIWI
-        await asyncio.sleep(3)
-
-    async def _reject_bill(self, bill: ActiveBills):
-        self.logger.info(f"# Пользователь {bill.user:<5} | Счет отклонен")
-        # Забронированные за пользователем подключения надо освободить.
-        for conn in bill.vpn_connections:
-            conn: VPNConnection
-            await conn.update(user_id=None, available_to=None, available=False)
+            await self._pay_bill(bill)
 
-        await bill.delete()
+    async def _pay_bill(self, bill: ActiveBills):
+        """
+        Активирует подключения оплаченного счета и удаляет счет.
 
-    async def _activate_connections(self, bill: ActiveBills):
-        # Активируем подключения
-        self.logger.info(f"# Пользователь {bill.user:<5} | Счет был оплачен")
+        Счет удаляется в той же транзакции, что и продление подключений.
+        Если счет одновременно обрабатывают проверка статусов и уведомление
+        платежной системы, то подключения продлит только одна из них.
+        """
+        async with async_db_session() as session:
+            if not await ActiveBills.claim(session, bill.id):
+                # Счет уже обработан.
+                return
 
-        for conn in bill.vpn_connections:
-            conn: VPNConnection
+            new_deadlines = await self._activate_connections(bill, session)
+            await session.commit()
 
-            # Выбираем сервер, на котором необходимо активировать подключения
-            try:
-                sc = ServerConnection(await Server.get(id=conn.server_id))
-            except Server.DoesNotExists:
-                continue
+        if self.rent_scheduler is not None:
+            for connection_id, new_rent_to in new_deadlines.items():
+                self.rent_scheduler.schedule(connection_id, new_rent_to)
 
-            await sc.connect()
-            # Размораживаем подключение на сервере
-            await sc.unfreeze_connection(conn.local_ip)
+    async def _reject_bill(self, bill: ActiveBills):
+        """
+        Удаляет отклоненный счет, для нового подключения освобождает
+        забронированные за пользователем подключения.
+
+        Счет удаляется через `ActiveBills.claim`, как и при оплате,
+        поэтому отклонение и оплата одного счета не выполнятся обе.
+        """
+        async with async_db_session() as session:
+            if not await ActiveBills.claim(session, bill.id):
+                # Счет уже обработан.
+                return
+
+            if bill.type == "new" and bill.vpn_connections:
+                await session.execute(
+                    update(VPNConnection),
+                    [
+                        {
+                            "id": conn.id,
+                            "user_id": None,
+                            "available_to": None,
+                            "available": False,
+                        }
+                        for conn in bill.vpn_connections
+                    ],
+                )
+            await session.commit()
 
-            if bill.type == "new":
-                # Если новое подключение
-                rent_type = "Новое подключение"
+        self.logger.info(f"# Пользователь {bill.user:<5} | Счет отклонен")
 
-            elif bill.type == "extend":
-                # Добавляем к текущему времени
-                rent_type = "Продление подключения"
+    async def _activate_connections(
+        self, bill: ActiveBills, session: AsyncSession
+    ) -> dict[int, datetime]:
+        """
+        Размораживает подключения счета на серверах и продлевает их аренду в базе.
+
+        Подключения группируются по серверам: на каждый сервер одна команда,
+        серверы обрабатываются одновременно.
+        Подключения блокируются до конца транзакции, поэтому заморозка
+        по истекшему сроку не выполнится между разморозкой и продлением.
+        Все изменения в базе выполняются одним запросом в переданной сессии.
+
+        :param session: Сессия, в транзакции которой обновляются подключения.
+        :return: Словарь {идентификатор подключения: новое окончание аренды}.
+        """
+        # Активируем подключения
+        self.logger.info(f"# Пользователь {bill.user:<5} | Счет был оплачен")
 
-            else:
-                continue
+        if bill.type == "new":
+            # Если новое подключение
+            rent_type = "Новое подключение"
+        elif bill.type == "extend":
+            # Добавляем к текущему времени
+            rent_type = "Продление подключения"
+        else:
+            return {}
+
+        locked = await VPNConnection.lock_rent(
+            session, [conn.id for conn in bill.vpn_connections]
+        )
+        connections_by_server: dict[int, list[VPNConnection]] = defaultdict(list)
+        for conn in locked:
+            connections_by_server[conn.server_id].append(conn)
+
+        activated = await asyncio.gather(
+            *(
+                self._unfreeze_on_server(server_id, connections)
+                for server_id, connections in connections_by_server.items()
+            )
+        )
 
+        new_deadlines = {}
+        values = []
+        for conn in chain.from_iterable(activated):
             # Либо продление, либо новое
             rent_time_from = conn.available_to or datetime.now()
 
@@ -107,9 +219,37 @@ class PaymentManager(BaseManager):
                 f"# Пользователь {bill.user:<5} | {rent_type}"
                 f" {conn.local_ip} на {bill.rent_month} мес. до {new_rent_to}"
             )
-
-            await conn.update(
-                available=True,
-                user_id=bill.user,
-                available_to=new_rent_to,
+            values.append(
+                {
+                    "id": conn.id,
+                    "available": True,
+                    "user_id": bill.user,
+                    "available_to": new_rent_to,
+                }
             )
+            new_deadlines[conn.id] = new_rent_to
+
+        if values:
+            await session.execute(update(VPNConnection), values)
+
+        return new_deadlines
+
+    async def _unfreeze_on_server(
+        self, server_id: int, connections: list[VPNConnection]
+    ) -> list[VPNConnection]:
+        """
+        # Размораживает подключения одного сервера одной командой.
+        :return: Размороженные подключения, пустой список, если сервера нет.
+        """
+        try:
+            server = await server_catalog.get(server_id)
+        except Server.DoesNotExists:
+            return []
+
+        try:
+            sc = await self.connect_to_server(server)
+            await sc.unfreeze_connections([conn.local_ip for conn in connections])
+        except Exception as exc:
+            self.invalidate_on_connection_error(server_id, exc)
+            raise
+        return connections
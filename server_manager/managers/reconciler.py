@@ -0,0 +1,90 @@
+import asyncio
+from datetime import datetime
+
+from db import Server, VPNConnection, server_catalog
+from .base import BaseManager
+
+
+class FrozenStateReconciler(BaseManager):
+    """
+    Сверяет замороженные подключения на серверах с состоянием в базе.
+
+    Для каждого сервера одной командой читает замороженные адреса,
+    сравнивает их с базой и одной командой исправляет только расхождения:
+
+    - недоступное подключение без активной аренды должно быть заморожено;
+    - доступное подключение с активной арендой должно быть разморожено.
+
+    Подключения, у которых есть счет (новый или продление, в том числе
+    обрабатываемый сейчас), забронированные без срока аренды подключения
+    и адреса, которых нет в базе, не трогаем.
+    """
+
+    timeout = 60 * 15
+
+    async def run(self):
+        print("=== Запущена сверка замороженных подключений ===")
+        while True:
+            await self.task()
+            await asyncio.sleep(self.timeout)
+
+    async def task(self):
+        servers = await server_catalog.all()
+        results = await self.for_each_server(
+            servers, self._reconcile_server, title="Сверка замороженных подключений"
+        )
+        results = [result for result in results if result is not None]
+        frozen = sum(result[0] for result in results)
+        unfrozen = sum(result[1] for result in results)
+        self.logger.info(
+            f"Сверка замороженных подключений | Серверов: {len(servers)}"
+            f" | Заморожено: {frozen} | Разморожено: {unfrozen}"
+        )
+
+    async def _reconcile_server(self, server: Server) -> tuple[int, int]:
+        """
+        :return: Кол-во замороженных и размороженных подключений.
+        """
+        # Сначала состояние базы, затем сервера. Оплата сначала размораживает
+        # подключение на сервере и только затем фиксирует продление в базе,
+        # поэтому в этом окне база отстает от сервера. Подключения, у которых
+        # есть счет (в том числе обрабатываемый сейчас), не трогаем.
+        connections, billed_ids = await VPNConnection.get_server_state(server.id)
+
+        sc = await self.connect_to_server(server)
+        actual_frozen = await sc.frozen_connections()
+
+        to_freeze, to_unfreeze = self._diff(connections, billed_ids, actual_frozen)
+        if not to_freeze and not to_unfreeze:
+            return 0, 0
+
+        self.logger.info(
+            f"# Сервер: {server.name:<15} | Расхождение с базой:"
+            f" заморозить {', '.join(to_freeze) or '-'},"
+            f" разморозить {', '.join(to_unfreeze) or '-'}"
+        )
+        await sc.update_frozen(freeze=to_freeze, unfreeze=to_unfreeze)
+        return len(to_freeze), len(to_unfreeze)
+
+    @staticmethod
+    def _diff(
+        connections: list[VPNConnection], billed_ids: set[int], actual_frozen: set[str]
+    ) -> tuple[list[str], list[str]]:
+        now = datetime.now()
+        to_freeze = []
+        to_unfreeze = []
+        for conn in connections:
+            if conn.id in billed_ids:
+                # Заморозку изменит оплата или отклонение счета.
+                continue
+            rent_active = conn.available_to is not None and conn.available_to > now
+            if conn.available and rent_active:
+                if conn.local_ip in actual_frozen:
+                    to_unfreeze.append(conn.local_ip)
+            elif conn.user_id is not None and conn.available_to is None:
+                # Забронировано под новый счет, заморозку снимет оплата.
+                continue
+            elif not conn.available and not rent_active:
+                if conn.local_ip not in actual_frozen:
+                    to_freeze.append(conn.local_ip)
+        return to_freeze, to_unfreeze
@@ -0,0 +1,73 @@
+import asyncio
+import heapq
+from datetime import datetime
+
+
+class RentExpiryScheduler:
+    """
+    Очередь ближайших сроков проверки аренды VPN подключений (min-heap).
+
+    Для каждого подключения хранится только последний назначенный срок,
+    устаревшие записи в куче пропускаются при извлечении.
+    """
+
+    def __init__(self):
+        self._heap: list[tuple[datetime, int]] = []
+        self._deadlines: dict[int, datetime] = {}
+        self._changed = asyncio.Event()
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def schedule(self, connection_id: int, due: datetime) -> None:
+        """
+        # Назначает (или переназначает) срок проверки подключения.
+        :param connection_id: Идентификатор VPN подключения.
+        :param due: Когда подключение надо проверить.
+        """
+        if self._deadlines.get(connection_id) == due:
+            return
+
+        self._deadlines[connection_id] = due
+        heapq.heappush(self._heap, (due, connection_id))
+
+        if self.next_deadline() == due:
+            # Появился более ранний срок, будим ожидающего.
+            self._changed.set()
+
+    def cancel(self, connection_id: int) -> None:
+        self._deadlines.pop(connection_id, None)
+
+    def pop_due(self, now: datetime) -> list[int]:
+        """
+        # Извлекает идентификаторы подключений, срок которых наступил.
+        """
+        due_ids = []
+        while self._heap and self._heap[0][0] <= now:
+            due, connection_id = heapq.heappop(self._heap)
+            if self._deadlines.get(connection_id) == due:
+                del self._deadlines[connection_id]
+                due_ids.append(connection_id)
+        return due_ids
+
+    def next_deadline(self) -> datetime | None:
+        # Убираем устаревшие записи с вершины кучи.
+        while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    async def wait(self, max_wait: float) -> None:
+        """
+        # Ждет ближайшего срока, но не дольше `max_wait` секунд.
+        Ожидание прерывается, если назначен более ранний срок.
+        """
+        next_deadline = self.next_deadline()
+        delay = max_wait
+        if next_deadline is not None:
+            delay = min(max_wait, (next_deadline - datetime.now()).total_seconds())
+
+        self._changed.clear()
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout=max(delay, 0))
+        except asyncio.TimeoutError:
+            pass
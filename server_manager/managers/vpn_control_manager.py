@@ -1,155 +1,322 @@
 """
 Данный код представляет собой менеджер для обработки аренды VPN подключений. Он выполняет следующие задачи:
 
-1. В бесконечном цикле получает все VPN подключения из базы данных без поля конфигурации.
+1. Раз в `timeout` секунд одним запросом по диапазону `available_to` выбирает из базы подключения,
+   аренду которых пора проверить в ближайшее время, и добавляет их сроки в очередь `RentExpiryScheduler`.
+   Неудачное пополнение повторяется через `seed_retry_timeout` секунд с удвоением паузы.
+   PaymentManager обновляет срок в очереди при продлении аренды.
 
-2. Для каждого подключения вызывает метод _process_connection(), который обрабатывает данное подключение.
-
-3. В методе _process_connection() проверяется, активно ли подключение.
-   Если нет, то происходит одно из следующих действий:
+2. Просыпается ровно к ближайшему сроку из очереди, загружает подошедшие подключения
+   и проверяет, активно ли подключение. Если нет, то происходит одно из следующих действий:
 
     - Если время окончания аренды подключения меньше текущего времени на 5 дней, подключение пересоздается и
       удаляется у пользователя.
-    - Если время окончания аренды подключения прошло, подключение замораживается.
+    - Если время окончания аренды подключения прошло, подключение замораживается,
+      а его пересоздание назначается в очереди через 5 дней.
+
+   Подключения обрабатываются пачками, сгруппированными по серверам.
 
-4. Метод _recreate_connection() пересоздает подключение, если время окончания аренды подключения меньше
-   текущего времени на 5 дней. Он выполняет следующие действия:
+3. Метод _freeze_connections() замораживает подключения одного сервера, у которых прошло время окончания аренды.
+   Он выполняет следующие действия:
 
     - Получает объект сервера по его идентификатору из базы данных.
-    - Создает подключение к серверу.
-    - Замораживает текущее подключение.
-    - Получает объект VPN подключения со всеми полями из базы данных.
-    - Пересоздает конфигурацию подключения.
-    - Обновляет конфигурацию в базе данных.
+    - Берет подключение к серверу из общего пула SSH подключений.
+    - Блокирует подключения в базе и заново проверяет срок аренды: аренду могли продлить
+      после выборки (например, оплата через webhook в процессе бота).
+    - Замораживает подключения одной командой (способ заморозки задает FREEZE_BACKEND).
+    - Обновляет статус доступности подключений в базе данных одним запросом
+      и снимает блокировку.
 
-5. Метод _freeze_connection() замораживает подключение, если время окончания аренды подключения прошло.
-   Он выполняет следующие действия:
+4. Метод _recreate_connections() пересоздает подключения одного сервера, у которых время окончания аренды
+   меньше текущего времени на 5 дней. Он выполняет следующие действия:
 
     - Получает объект сервера по его идентификатору из базы данных.
-    - Создает подключение к серверу.
-    - Замораживает текущее подключение.
-    - Обновляет статус доступности подключения в базе данных.
+    - Берет подключение к серверу из общего пула SSH подключений.
+    - Замораживает подключения одной командой.
+    - Получает объекты VPN подключений со всеми полями из базы данных одним запросом.
+    - Пересоздает конфигурации одним запросом к серверу (`wg set` и одна запись конфигурации wireguard).
+    - Обновляет конфигурации в базе данных одним запросом.
+
+Если обработка подключения завершилась ошибкой, повторная попытка назначается через `retry_timeout` секунд.
 """
 
-import asyncio
+from collections import defaultdict
 from datetime import datetime, timedelta
+from typing import Awaitable, Callable
 
 from asyncssh import ProcessError
+from sqlalchemy import update
 
-from db import VPNConnection, Server
+from db import VPNConnection, Server, server_catalog, async_db_session
 from .base import BaseManager
-from .. import ServerConnection, ConfigBuilder
+from .scheduler import RentExpiryScheduler
+from .. import ConfigBuilder, ServerConnectionPool
 
 
 class VPNControlManager(BaseManager):
-    timeout = 60 * 10
+    # Как часто пополняем очередь сроков из базы (и горизонт этой выборки).
+    timeout = 60 * 60
+    # Через сколько после окончания аренды подключение пересоздается.
+    recreate_after = timedelta(days=5)
+    # Через сколько секунд повторить обработку подключения после ошибки.
+    retry_timeout = 60 * 10
+    # Первая пауза перед повтором неудачного пополнения очереди (секунды),
+    # каждая следующая вдвое больше, но не больше `timeout`.
+    seed_retry_timeout = 10
+
+    connection_fields = [
+        "server_id",
+        "user_id",
+        "available",
+        "local_ip",
+        "available_to",
+        "client_name",
+    ]
+
+    def __init__(
+        self,
+        ssh_pool: ServerConnectionPool | None = None,
+        rent_scheduler: RentExpiryScheduler | None = None,
+    ):
+        super().__init__(ssh_pool)
+        self.rent_scheduler = rent_scheduler or RentExpiryScheduler()
 
     async def run(self):
         print("=== Запущен обработчик аренды VPN подключений ===")
+        next_seed_time = datetime.now()
+        seed_retry_timeout = self.seed_retry_timeout
         while True:
+            if datetime.now() >= next_seed_time:
+                if await self._seed_scheduler():
+                    seed_retry_timeout = self.seed_retry_timeout
+                    next_seed_time = datetime.now() + timedelta(seconds=self.timeout)
+                else:
+                    # Без пополнения истекшие подключения не будут заморожены.
+                    next_seed_time = datetime.now() + timedelta(
+                        seconds=seed_retry_timeout
+                    )
+                    seed_retry_timeout = min(seed_retry_timeout * 2, self.timeout)
+
             await self.task()
-            await asyncio.sleep(self.timeout)
 
-    async def task(self):
-        # Вытягиваем из базы все VPN подключения, но без поля конфигурации.
-        all_connections = await VPNConnection.all(
-            values=[
-                "server_id",
-                "user_id",
-                "available",
-                "local_ip",
-                "available_to",
-                "client_name",
-            ]
-        )
+            await self.rent_scheduler.wait(
+                max_wait=(next_seed_time - datetime.now()).total_seconds()
+            )
 
-        for connection in all_connections:
-            await self._process_connection(connection)
+    async def _seed_scheduler(self) -> bool:
+        """
+        Добавляет в очередь сроки, которые наступят до следующего пополнения.
+        :return: False, если не удалось получить сроки из базы.
+        """
+        horizon = datetime.now() + timedelta(seconds=self.timeout)
+        try:
+            connections = await VPNConnection.get_rent_deadlines(
+                available_until=horizon, frozen_until=horizon - self.recreate_after
+            )
+        except Exception as exc:
+            self.logger.error(
+                f"Обработчик аренды VPN подключений | Ошибка: {exc}", exc_info=exc
+            )
+            return False
+
+        for connection in connections:
+            self.rent_scheduler.schedule(connection.id, self._due_time(connection))
+        return True
+
+    def _due_time(self, connection: VPNConnection) -> datetime:
+        if connection.available:
+            # Доступное подключение надо заморозить по окончании аренды.
+            return connection.available_to
+        # Замороженное подключение надо пересоздать.
+        return connection.available_to + self.recreate_after
+
+    async def task(self):
+        due_ids = self.rent_scheduler.pop_due(datetime.now())
+        if not due_ids:
+            return
 
-    async def _process_connection(self, connection: VPNConnection):
+        # Вытягиваем из базы подошедшие VPN подключения, но без поля конфигурации.
         try:
-            if not connection.available_to or connection.available_to > datetime.now():
-                # Подключение не назначено или еще активно.
-                return
+            connections = await VPNConnection.in_bulk(
+                due_ids, values=self.connection_fields
+            )
+        except Exception as exc:
+            self.logger.error(
+                f"Обработчик аренды VPN подключений | Ошибка: {exc}", exc_info=exc
+            )
+            retry_time = datetime.now() + timedelta(seconds=self.retry_timeout)
+            for connection_id in due_ids:
+                self.rent_scheduler.schedule(connection_id, retry_time)
+            return
+
+        # Подключения, которые надо заморозить или пересоздать,
+        # группируем по серверам.
+        to_freeze: dict[int, list[VPNConnection]] = defaultdict(list)
+        to_recreate: dict[int, list[VPNConnection]] = defaultdict(list)
+        now = datetime.now()
+        for connection in connections:
+            if not connection.available_to:
+                # Подключение не назначено.
+                continue
+
+            if connection.available_to > now:
+                # Подключение еще активно (например, аренду продлили).
+                self.rent_scheduler.schedule(connection.id, connection.available_to)
 
             # Если поле available_to меньше текущего времени на 5 дней
-            if connection.available_to < datetime.now() - timedelta(days=5):
+            elif connection.available_to < now - self.recreate_after:
                 # Необходимо пересоздать подключение и удалить его у пользователя
-                await self._recreate_connection(connection)
+                to_recreate[connection.server_id].append(connection)
 
-            elif connection.available_to < datetime.now():
+            else:
                 # Вышел строк аренды подключения - замораживаем.
-                await self._freeze_connection(connection)
+                to_freeze[connection.server_id].append(connection)
+
+        for server_id, server_connections in to_freeze.items():
+            await self._process_server_safe(
+                self._freeze_connections, server_id, server_connections
+            )
+        for server_id, server_connections in to_recreate.items():
+            await self._process_server_safe(
+                self._recreate_connections, server_id, server_connections
+            )
 
+    async def _process_server_safe(
+        self,
+        handler: Callable[[int, list[VPNConnection]], Awaitable[None]],
+        server_id: int,
+        connections: list[VPNConnection],
+    ):
+        try:
+            await handler(server_id, connections)
         except Exception as exc:
+            self.invalidate_on_connection_error(server_id, exc)
             self.logger.error(
                 f"Обработчик аренды VPN подключений |"
-                f" Подключение: {connection.local_ip} | Ошибка: {exc}",
+                f" Сервер: {server_id} | Ошибка: {exc}",
                 exc_info=exc,
             )
+            for connection in connections:
+                self._schedule_retry(connection)
+
+    def _schedule_retry(self, connection: VPNConnection):
+        self.rent_scheduler.schedule(
+            connection.id, datetime.now() + timedelta(seconds=self.retry_timeout)
+        )
 
-    async def _recreate_connection(self, connection: VPNConnection):
+    async def _recreate_connections(
+        self, server_id: int, connections: list[VPNConnection]
+    ):
+        """
+        Пересоздает подключения одного сервера и освобождает их от пользователей.
+        На сервере все подключения замораживаются и пересоздаются пачкой.
+        """
         try:
-            server = await Server.get(id=connection.server_id)
+            server = await server_catalog.get(server_id)
         except Server.DoesNotExists:
             return
 
-        sc = ServerConnection(server)
-        await sc.connect()
+        sc = await self.connect_to_server(server)
 
+        local_ips = [connection.local_ip for connection in connections]
         self.logger.info(
             f"# Сервер: {server.name:<15} | "
-            f"Подключение {connection.local_ip} необходимо пересоздать"
+            f"Подключения {', '.join(local_ips)} необходимо пересоздать"
         )
 
         try:
-            # Замораживаем подключение, на всякий случай.
-            await sc.freeze_connection(connection.local_ip)
-            # Вытягиваем из базы объект VPN подключения со всеми полями.
-            try:
-                config_obj: VPNConnection = await VPNConnection.get(id=connection.id)
-            except VPNConnection.DoesNotExists:
+            # Замораживаем подключения, на всякий случай.
+            await sc.freeze_connections(local_ips)
+            # Вытягиваем из базы объекты VPN подключений со всеми полями.
+            config_objs = await VPNConnection.in_bulk(
+                [connection.id for connection in connections]
+            )
+            if not config_objs:
                 return
 
-            print(config_obj.id, config_obj.client_name, config_obj.config)
-
-            # Пересоздаем конфигурацию.
-            new_config = await sc.regenerate_config(
-                ConfigBuilder(config=config_obj.config, name=config_obj.client_name)
+            # Пересоздаем конфигурации.
+            new_configs = await sc.regenerate_configs(
+                [
+                    ConfigBuilder(config=config_obj.config, name=config_obj.client_name)
+                    for config_obj in config_objs
+                ]
             )
-            # Обновляем конфигурацию в базе.
-            await config_obj.update(config=new_config.create_config())
-
-            config_obj: VPNConnection = await VPNConnection.get(id=connection.id)
-            print(config_obj.id, config_obj.client_name, config_obj.config)
 
         except (ConnectionError, ProcessError) as exc:
             exc: ProcessError
+            self.invalidate_on_connection_error(server_id, exc)
             # В случае ошибки на стороне сервера, будет попытка на следующей итерации.
             self.logger.error(
                 f"# Сервер: {server.name:<15} | "
-                f"Подключение: {connection.local_ip} | Ошибка: {exc.stderr}",
+                f"Подключения: {', '.join(local_ips)} | Ошибка: {exc.stderr}",
                 exc_info=exc,
             )
+            for connection in connections:
+                self._schedule_retry(connection)
+            return
 
-        else:
-            # Освобождаем подключение от пользователя.
-            await connection.update(user_id=None, available_to=None, available=False)
+        # Обновляем конфигурации в базе и освобождаем подключения от пользователей.
+        # Хэш файлов на сервере пересчитает сборщик конфигураций.
+        await VPNConnection.bulk_save(
+            to_update=[
+                {
+                    "id": config_obj.id,
+                    "config": new_config.create_config(),
+                    "config_hash": None,
+                    "user_id": None,
+                    "available_to": None,
+                    "available": False,
+                }
+                for config_obj, new_config in zip(config_objs, new_configs)
+            ]
+        )
 
-    async def _freeze_connection(self, connection: VPNConnection):
+    async def _freeze_connections(
+        self, server_id: int, connections: list[VPNConnection]
+    ):
+        """
+        Замораживает подключения одного сервера одной командой.
+        """
         try:
-            server = await Server.get(id=connection.server_id)
+            server = await server_catalog.get(server_id)
         except Server.DoesNotExists:
             return
 
-        sc = ServerConnection(server)
-        await sc.connect()
+        sc = await self.connect_to_server(server)
 
-        self.logger.info(
-            f"# Сервер: {server.name:<15} | "
-            f"Подключение {connection.local_ip} необходимо заморозить"
-        )
+        async with async_db_session() as session:
+            # Блокируем подключения и заново проверяем срок: аренду могли продлить
+            # после выборки, в том числе оплата через webhook в процессе бота.
+            locked = await VPNConnection.lock_rent(
+                session, [connection.id for connection in connections]
+            )
+            now = datetime.now()
+            expired = []
+            for connection in locked:
+                if connection.available_to and connection.available_to > now:
+                    self.rent_scheduler.schedule(connection.id, connection.available_to)
+                else:
+                    expired.append(connection)
+            if not expired:
+                return
+
+            local_ips = [connection.local_ip for connection in expired]
+            self.logger.info(
+                f"# Сервер: {server.name:<15} | "
+                f"Подключения {', '.join(local_ips)} необходимо заморозить"
+            )
 
-        await sc.freeze_connection(connection.local_ip)
-        # Подключение недоступно.
-        await connection.update(available=False)
+            await sc.freeze_connections(local_ips)
+            # Подключения недоступны.
+            await session.execute(
+                update(VPNConnection),
+                [{"id": connection.id, "available": False} for connection in expired],
+            )
+            await session.commit()
+
+        # Через 5 дней подключения надо будет пересоздать.
+        for connection in expired:
+            if connection.available_to:
+                self.rent_scheduler.schedule(
+                    connection.id, connection.available_to + self.recreate_after
+                )
@@ -1 +1,5 @@
+from .batch import CommandBatch, BatchStepError
 from .connection import ServerConnection
+from .freeze import FreezeBackend, RouteFreezeBackend, NftSetFreezeBackend
+from .pool import ServerConnectionPool
+from .params import wg_params_cache
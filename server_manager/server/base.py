@@ -1,5 +1,6 @@
 import logging
 from abc import ABC, abstractmethod
+from typing import Iterable
 
 import asyncssh
 from asyncssh import SSHClientConnection
@@ -7,6 +8,8 @@ from asyncssh.logging import logger
 
 from db.models import Server
 from ..configuration.base import BaseConfigBuilder
+from .batch import CommandBatch
+from .pool import ServerConnectionPool
 
 logger.setLevel(level=logging.ERROR)
 
@@ -15,7 +18,8 @@ class ServerConnectionBase(ABC):
     config_file_prefix = "wg0-client"
     config_builder = None
 
-    def __init__(self, server: Server):
+    def __init__(self, server: Server, pool: ServerConnectionPool | None = None):
+        self.server_id = server.id
         self.auth = {
             "host": server.ip,
             "port": server.port,
@@ -25,10 +29,21 @@ class ServerConnectionBase(ABC):
         }
         self._configs: list[BaseConfigBuilder] = []
 
+        self._pool = pool
         self._conn: SSHClientConnection | None = None
 
     async def connect(self):
-        self._conn = await asyncssh.connect(**self.auth)
+        if self._pool is not None:
+            # Подключение берется из пула и закрывается только им.
+            self._conn = await self._pool.acquire(self.server_id, self.auth)
+        else:
+            self._conn = await asyncssh.connect(**self.auth)
+
+    def command_batch(self, timeout: int = 10) -> CommandBatch:
+        """
+        # Пакет команд, которые будут выполнены на сервере одним запросом.
+        """
+        return CommandBatch(self._conn, timeout=timeout)
 
     @property
     def config_files(self):
@@ -42,10 +57,18 @@ class ServerConnectionBase(ABC):
     async def unfreeze_connection(self, connection_ip: str):
         pass
 
+    @abstractmethod
+    async def unfreeze_connections(self, connection_ips: Iterable[str]):
+        pass
+
     @abstractmethod
     async def freeze_connection(self, connection_ip: str):
         pass
 
+    @abstractmethod
+    async def freeze_connections(self, connection_ips: Iterable[str]):
+        pass
+
     @abstractmethod
     async def regenerate_config(
         self, config_manager: BaseConfigBuilder
@@ -53,5 +76,5 @@ class ServerConnectionBase(ABC):
         pass
 
     def __del__(self, **kwargs):
-        self._conn.close()
-        del self
+        if self._conn is not None and self._pool is None:
+            self._conn.close()
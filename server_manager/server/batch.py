@@ -0,0 +1,151 @@
+import base64
+from dataclasses import dataclass
+
+from asyncssh import ProcessError, SSHClientConnection
+
+
+@dataclass
+class StepResult:
+    """
+    Результат одной команды из пакета.
+    """
+
+    index: int
+    name: str
+    command: str
+    ok_statuses: tuple[int, ...]
+    # None - команда не выполнялась, так как предыдущая завершилась с ошибкой.
+    exit_status: int | None = None
+    stdout: str = ""
+    stderr: str = ""
+
+    @property
+    def skipped(self) -> bool:
+        return self.exit_status is None
+
+    @property
+    def ok(self) -> bool:
+        return self.exit_status in self.ok_statuses
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise BatchStepError(self)
+
+
+class BatchStepError(ProcessError):
+    """
+    Команда из пакета завершилась с ошибкой или не была выполнена.
+    Наследуется от ProcessError, чтобы обрабатываться так же, как ошибки `run`.
+    """
+
+    def __init__(self, step: StepResult):
+        self.step = step
+        if step.skipped:
+            reason = f"Шаг {step.index} ({step.name}) не был выполнен"
+        else:
+            reason = (
+                f"Шаг {step.index} ({step.name}) завершился"
+                f" с кодом {step.exit_status}: {step.stderr.strip()}"
+            )
+        super().__init__(
+            None,
+            step.command,
+            None,
+            step.exit_status,
+            None,
+            step.exit_status,
+            step.stdout,
+            step.stderr,
+            reason,
+        )
+
+
+class CommandBatch:
+    """
+    Пакет команд, который выполняется на сервере одним скриптом.
+
+    Каждая команда выполняется с отдельным перехватом stdout и stderr,
+    после нее скрипт печатает строку `<номер> <код> <stdout base64> <stderr base64>`.
+    Если код возврата не входит в допустимые, оставшиеся команды не выполняются.
+    """
+
+    def __init__(self, conn: SSHClientConnection, timeout: int = 10):
+        self._conn = conn
+        self.timeout = timeout
+        self._steps: list[StepResult] = []
+
+    def __len__(self):
+        return len(self._steps)
+
+    def add(
+        self, command: str, name: str = "", ok_statuses: tuple[int, ...] = (0,)
+    ) -> int:
+        """
+        # Добавляет команду в пакет.
+        :param command: Команда bash, может состоять из нескольких строк.
+        :param name: Название шага для сообщений об ошибках.
+        :param ok_statuses: Коды возврата, которые не считаются ошибкой.
+        :return: Номер шага в результатах выполнения.
+        """
+        index = len(self._steps)
+        self._steps.append(
+            StepResult(
+                index=index,
+                name=name or command.split(maxsplit=1)[0],
+                command=command,
+                ok_statuses=tuple(ok_statuses),
+            )
+        )
+        return index
+
+    def script(self) -> str:
+        lines = ["__batch_dir=$(mktemp -d)", "trap 'rm -rf \"$__batch_dir\"' EXIT"]
+        for step in self._steps:
+            statuses = "|".join(str(status) for status in step.ok_statuses)
+            lines += [
+                # Команда выполняется в подшелле, чтобы `exit` не завершил скрипт,
+                # stdin перенаправлен, чтобы команда не прочитала остаток скрипта.
+                "(",
+                step.command,
+                ') </dev/null >"$__batch_dir/out" 2>"$__batch_dir/err"',
+                "__status=$?",
+                f"printf '{step.index} %d %s %s\\n' \"$__status\""
+                ' "$(base64 -w0 <"$__batch_dir/out")"'
+                ' "$(base64 -w0 <"$__batch_dir/err")"',
+                f'case "$__status" in {statuses}) ;; *) exit 0 ;; esac',
+            ]
+        return "\n".join(lines) + "\n"
+
+    async def run(self, check: bool = True) -> list[StepResult]:
+        """
+        # Выполняет все команды пакета одним запросом к серверу.
+        :param check: Вызвать BatchStepError для первого неуспешного шага.
+        :return: Результаты шагов в порядке добавления.
+        """
+        results = [
+            StepResult(
+                index=step.index,
+                name=step.name,
+                command=step.command,
+                ok_statuses=step.ok_statuses,
+            )
+            for step in self._steps
+        ]
+        if not results:
+            return results
+
+        process = await self._conn.run(
+            "bash -s", input=self.script(), timeout=self.timeout
+        )
+        for line in process.stdout.splitlines():
+            index, exit_status, stdout, stderr = line.split(" ")
+            result = results[int(index)]
+            result.exit_status = int(exit_status)
+            result.stdout = base64.b64decode(stdout).decode(errors="replace")
+            result.stderr = base64.b64decode(stderr).decode(errors="replace")
+
+        if check:
+            for result in results:
+                result.raise_for_status()
+
+        return results
@@ -1,21 +1,112 @@
+import asyncio
+import logging
 import re
+from shlex import quote
+from typing import Iterable
 
-from asyncssh import ProcessError
+from asyncssh import SSHReader
 
 from ..configuration.base import Config
 from ..configuration.manager import ConfigBuilder
 from ..server.base import ServerConnectionBase
+from .batch import CommandBatch
+from .freeze import get_freeze_backend
+from .keys import keypair_pool, public_key_from_private
+from .params import wg_params_cache
 from ..server.types import WGParams, KeyPair
 
 
 class ServerConnection(ServerConnectionBase):
     config_builder = ConfigBuilder
+    # Способ заморозки подключений, выбирается переменной FREEZE_BACKEND.
+    freeze_backend = get_freeze_backend()
+    # Запас ключей клиентов, генерируемых без обращения к серверу.
+    keypair_pool = keypair_pool
+    # Параметры wireguard серверов, общие для всех подключений.
+    wg_params_cache = wg_params_cache
+    wg_params_file = "/etc/wireguard/params"
+    # Ограничение времени на сбор всех конфигураций сервера одной командой.
+    bulk_timeout = 30
 
     @property
     def config_files(self):
         return self._configs
 
-    async def collect_configs(self, folder="/root"):
+    async def collect_configs(
+        self, folder="/root", bulk: bool = True, names: Iterable[str] | None = None
+    ):
+        """
+        Собирает с сервера конфигурации клиентов.
+
+        :param folder: Папка с файлами конфигураций.
+        :param bulk: Собрать все файлы одной командой (по умолчанию),
+         иначе каждый файл читается отдельной командой.
+        :param names: Имена файлов, которые надо собрать, если нет, то все.
+        """
+        if bulk:
+            await asyncio.wait_for(
+                self._collect_configs_bulk(folder, names), timeout=self.bulk_timeout
+            )
+        else:
+            await self._collect_configs_one_by_one(folder)
+
+    async def collect_config_hashes(self, folder="/root") -> dict[str, str]:
+        """
+        Возвращает SHA-256 каждого файла конфигурации без передачи содержимого.
+        :return: Словарь {имя файла: хэш}.
+        """
+        result = await self._conn.run(
+            f"cd {folder} && sha256sum {self.config_file_prefix}-*.conf", timeout=3
+        )
+        return {
+            file_name: file_hash
+            for file_hash, file_name in re.findall(
+                r"([0-9a-f]{64})\s+\*?(wg0-client-\d+?\.conf)", result.stdout
+            )
+        }
+
+    async def _collect_configs_bulk(self, folder: str, names: Iterable[str] | None):
+        """
+        Читает все файлы конфигураций за один запрос к серверу.
+
+        Каждый файл передается кадром: строка заголовка `<имя> <размер в байтах>`,
+        а затем ровно столько байт содержимого файла.
+        Конфигурации разбираются по мере получения кадров.
+        """
+        if names is None:
+            files = f"{folder}/{self.config_file_prefix}-*.conf"
+        else:
+            files = " ".join(
+                f"{folder}/{name}"
+                for name in names
+                if re.fullmatch(r"wg0-client-\d+?\.conf", name)
+            )
+            if not files:
+                return
+
+        command = (
+            f"for f in {files}; do "
+            '[ -f "$f" ] || continue; '
+            's=$(stat -c %s "$f"); '
+            'printf "%s %s\\n" "$(basename "$f")" "$s"; '
+            'head -c "$s" "$f"; '
+            "done"
+        )
+
+        async with self._conn.create_process(command, encoding=None) as process:
+            async for file_name, content in self._read_config_frames(process.stdout):
+                if not re.fullmatch(r"wg0-client-\d+?\.conf", file_name):
+                    continue
+                self._configs.append(self.config_builder(content, name=file_name))
+
+    @staticmethod
+    async def _read_config_frames(stream: SSHReader):
+        while header := await stream.readline():
+            file_name, size = header.decode().rstrip("\n").rsplit(" ", 1)
+            content = await stream.readexactly(int(size))
+            yield file_name, content.decode()
+
+    async def _collect_configs_one_by_one(self, folder: str):
         list_config_cmd = rf"ls -l {folder} | grep {self.config_file_prefix}"
 
         result = await self._conn.run(list_config_cmd, timeout=3)
@@ -26,70 +117,156 @@ class ServerConnection(ServerConnectionBase):
             self._configs.append(config_manager)
 
     async def unfreeze_connection(self, connection_ip: str):
-        try:
-            await self._conn.run(
-                f"ip route del {connection_ip} via 127.0.0.1", check=True, timeout=3
-            )
-        except ProcessError as exc:
-            # Если уже разморожено
-            if exc.exit_status != 2:
-                raise exc
+        await self.unfreeze_connections([connection_ip])
+
+    async def unfreeze_connections(self, connection_ips: Iterable[str]):
+        """
+        Размораживает несколько подключений сервера одной командой.
+        Уже размороженные подключения пропускаются.
+        """
+        await self.update_frozen(unfreeze=connection_ips)
 
     async def freeze_connection(self, connection_ip: str):
-        try:
-            await self._conn.run(
-                f"ip route add {connection_ip} via 127.0.0.1", check=True, timeout=3
-            )
-        except ProcessError as exc:
-            # Если уже заморожено
-            if exc.exit_status != 2:
-                raise exc
+        await self.freeze_connections([connection_ip])
+
+    async def freeze_connections(self, connection_ips: Iterable[str]):
+        """
+        Замораживает несколько подключений сервера одной командой.
+        Уже замороженные подключения пропускаются.
+        """
+        await self.update_frozen(freeze=connection_ips)
+
+    async def update_frozen(
+        self, freeze: Iterable[str] = (), unfreeze: Iterable[str] = ()
+    ):
+        """
+        Замораживает и размораживает подключения одной командой.
+        """
+        freeze, unfreeze = list(freeze), list(unfreeze)
+        if not freeze and not unfreeze:
+            return
+
+        batch = self.command_batch()
+        self.freeze_backend.add_setup(batch)
+        self.freeze_backend.add_freeze(batch, freeze)
+        self.freeze_backend.add_unfreeze(batch, unfreeze)
+        await batch.run()
+
+    async def frozen_connections(self) -> set[str]:
+        """
+        Адреса подключений, которые сейчас заморожены на сервере.
+        """
+        batch = self.command_batch()
+        self.freeze_backend.add_setup(batch)
+        step = self.freeze_backend.add_list(batch)
+        results = await batch.run()
+        return self.freeze_backend.parse_list(results[step].stdout)
 
     async def regenerate_config(self, config_manager: config_builder) -> config_builder:
-        config = config_manager.config
-        wg_params = await self._get_wg_params()
-        key_pair = await self._get_keypair()
+        """
+        Пересоздает конфигурацию клиента с новыми ключами.
+        """
+        new_config_managers = await self.regenerate_configs([config_manager])
+        return new_config_managers[0]
 
-        await self._remove_client(config, wg_params)
-        await self._restart_wireguard(wg_params)
+    async def regenerate_configs(
+        self, config_managers: list[config_builder]
+    ) -> list[config_builder]:
+        """
+        Пересоздает конфигурации нескольких клиентов сервера с новыми ключами.
 
-        # Новая конфигурация
-        new_config_manager = await self._create_and_get_new_config_file_manager(
-            config=config, wg_params=wg_params, key_pair=key_pair
-        )
+        Ключи генерируются локально, параметры wireguard берутся из кэша.
+        Все изменения применяются одним запросом к серверу:
+        файлы клиентов, одна атомарная перезапись конфигурации интерфейса
+        и один `wg set` со всеми удаляемыми и добавляемыми пирами.
 
-        await self._add_client(
-            config=new_config_manager.config, wg_params=wg_params, key_pair=key_pair
-        )
-        await self._restart_wireguard(wg_params)
+        :return: Новые конфигурации в том же порядке.
+        """
+        if not config_managers:
+            return []
 
-        return new_config_manager
+        wg_params = await self.get_wg_params()
 
-    async def _get_wg_params(self) -> WGParams:
-        result = await self._conn.run(
-            "cat /etc/wireguard/params", check=True, timeout=3
-        )
-        file_lines = re.findall(r"([A-Z\d_]+)=(.+)\n?", result.stdout)
-        return WGParams(**{key: value for key, value in file_lines})
+        new_config_managers = []
+        removed_peers = []
+        added_peers = []
+        # Клиенты, открытый ключ которых не удалось получить из конфигурации.
+        unknown_key_clients = []
+        for config_manager in config_managers:
+            config = config_manager.config
+            key_pair = self.keypair_pool.get()
 
-    async def _get_keypair(self) -> KeyPair:
-        """Generate key pair for the client"""
+            # Новая конфигурация
+            new_config_manager = self._create_new_config_file_manager(
+                config=config, wg_params=wg_params, key_pair=key_pair
+            )
+            new_config_managers.append(new_config_manager)
 
-        result = await self._conn.run(r"wg genkey", check=True, timeout=3)
-        client_private_key = result.stdout.strip()
-        result = await self._conn.run(
-            rf'echo "{client_private_key}" | wg pubkey', check=True, timeout=3
+            if old_public_key := self._client_public_key(config):
+                removed_peers.append(old_public_key)
+            else:
+                unknown_key_clients.append(config.client_name)
+            added_peers.append((new_config_manager.config, key_pair))
+
+        batch = self.command_batch(timeout=30)
+        self._write_config_files(batch, new_config_managers)
+        self._persist_peers(
+            batch,
+            wg_params,
+            removed_clients=[cm.config.client_name for cm in config_managers],
+            added_peers=added_peers,
         )
-        client_public_key = result.stdout.strip()
-        result = await self._conn.run(r"wg genpsk", check=True, timeout=3)
-        client_pre_shared_key = result.stdout.strip()
-        return KeyPair(
-            public_key=client_public_key,
-            private_key=client_private_key,
-            pre_shared_key=client_pre_shared_key,
+        self._apply_peers(batch, wg_params, removed_peers, added_peers)
+        if unknown_key_clients:
+            # Старый пир нельзя удалить по ключу, иначе он останется рабочим
+            # рядом с новым: приводим интерфейс к записанному файлу.
+            logging.getLogger(self.__class__.__name__).warning(
+                f"# Сервер: {self.server_id:<5} | Не удалось получить открытый ключ"
+                f" клиентов {', '.join(unknown_key_clients)}, выполняем wg syncconf"
+            )
+            self._sync_interface(batch, wg_params)
+        await batch.run()
+
+        return new_config_managers
+
+    async def get_wg_params(self, refresh: bool = False) -> WGParams:
+        """
+        Параметры wireguard сервера.
+
+        :param refresh: Прочитать файл параметров заново, не проверяя кэш.
+        """
+        cached = None if refresh else self.wg_params_cache.get(self.server_id)
+        if cached is not None and self.wg_params_cache.is_fresh(cached):
+            return cached.params
+
+        # Файл читается, только если изменился с момента последнего чтения.
+        token = cached.token if cached is not None else ""
+        batch = self.command_batch()
+        step = batch.add(
+            f'token=$(stat -c "%y %s %i" {self.wg_params_file}) && echo "$token"'
+            f' && if [ "$token" != "{token}" ]; then cat {self.wg_params_file}; fi',
+            name="wg params",
         )
+        results = await batch.run()
+        new_token, _, text = results[step].stdout.partition("\n")
+
+        if cached is not None and new_token == cached.token:
+            self.wg_params_cache.touch(self.server_id)
+            return cached.params
+
+        wg_params = self._parse_wg_params(text)
+        self.wg_params_cache.set(self.server_id, wg_params, new_token)
+        return wg_params
+
+    async def refresh_wg_params(self) -> WGParams:
+        return await self.get_wg_params(refresh=True)
 
-    async def _create_and_get_new_config_file_manager(
+    @staticmethod
+    def _parse_wg_params(text: str) -> WGParams:
+        file_lines = re.findall(r"([A-Z\d_]+)=(.+)\n?", text)
+        return WGParams(**{key: value for key, value in file_lines})
+
+    def _create_new_config_file_manager(
         self, config: Config, wg_params: WGParams, key_pair: KeyPair
     ) -> config_builder:
         # Новая конфигурация
@@ -104,44 +281,86 @@ PresharedKey = {key_pair.pre_shared_key}
 Endpoint = {wg_params.endpoint}
 AllowedIPs = 0.0.0.0/0,::/0"""
 
-        # Create client file and add the server as a peer
-        await self._conn.run(
-            rf'''echo "{new_config}" >>"/root/{config.name}"''', check=True, timeout=3
-        )
-
         return self.config_builder(config=new_config, name=config.name)
 
-    async def _add_client(self, config: Config, wg_params: WGParams, key_pair: KeyPair):
-        """Add the client as a peer to the server"""
+    @staticmethod
+    def _client_public_key(config: Config) -> str | None:
+        """Public key of the client, derived from the PrivateKey of its config"""
+        for line in config.rows:
+            if match := re.match(r"PrivateKey = (\S+)", line):
+                try:
+                    return public_key_from_private(match.group(1))
+                except ValueError:
+                    return None
+        return None
 
-        await self._conn.run(
-            rf'''echo -e "\n### Client {config.client_name}
-[Peer]
-PublicKey = {key_pair.public_key}
-PresharedKey = {key_pair.pre_shared_key}
-AllowedIPs = {config.client_ip_v4}/32,{config.client_ip_v6}/128" >>"/etc/wireguard/{wg_params.SERVER_WG_NIC}.conf"''',
-            check=True,
-            timeout=3,
+    @staticmethod
+    def _write_config_files(batch: CommandBatch, config_managers: list[config_builder]):
+        """Create client files"""
+        batch.add(
+            "\n".join(
+                f"printf '%s\\n' {quote(cm.config.config_text)}"
+                f" >{quote(f'/root/{cm.config.name}')}"
+                for cm in config_managers
+            ),
+            name="write client configs",
         )
 
-    async def _remove_client(self, config: Config, wg_params: WGParams):
+    @staticmethod
+    def _persist_peers(
+        batch: CommandBatch,
+        wg_params: WGParams,
+        removed_clients: list[str],
+        added_peers: list[tuple[Config, KeyPair]],
+    ):
         """
-        remove [Peer] block matching `config.client_name`.
-
-        remove generated client file.
+        Rewrite the interface config once: remove `### Client N` blocks
+        and append new [Peer] blocks, then atomically replace the file.
         """
-
-        await self._conn.run(
-            rf'sed -i "/^### Client {config.client_name}\$/,/^$/d" "/etc/wireguard/{wg_params.SERVER_WG_NIC}.conf"',
-            timeout=3,
-            check=True,
+        sed_expressions = " ".join(
+            f"-e {quote(f'/^### Client {client_name}$/,/^$/d')}"
+            for client_name in removed_clients
         )
-        await self._conn.run(rf'rm -f "/root/{config.name}"', timeout=3)
-
-    async def _restart_wireguard(self, wg_params: WGParams):
-        """Restart wireguard to apply changes"""
-        await self._conn.run(
-            rf'wg syncconf "{wg_params.SERVER_WG_NIC}" <(wg-quick strip "{wg_params.SERVER_WG_NIC}")',
-            check=True,
-            timeout=3,
+        peers = "".join(
+            f"\n### Client {config.client_name}\n"
+            f"[Peer]\n"
+            f"PublicKey = {key_pair.public_key}\n"
+            f"PresharedKey = {key_pair.pre_shared_key}\n"
+            f"AllowedIPs = {config.client_ip_v4}/32,{config.client_ip_v6}/128\n"
+            for config, key_pair in added_peers
         )
+        conf = quote(f"/etc/wireguard/{wg_params.SERVER_WG_NIC}.conf")
+        batch.add(
+            f"tmp=$(mktemp {conf}.XXXXXX) || exit 1\n"
+            f'sed {sed_expressions} {conf} >"$tmp"'
+            f" && printf '%s' {quote(peers)} >>\"$tmp\""
+            f' && chmod 600 "$tmp" && mv "$tmp" {conf}'
+            f' || {{ rm -f "$tmp"; exit 1; }}',
+            name="persist peers",
+        )
+
+    @staticmethod
+    def _apply_peers(
+        batch: CommandBatch,
+        wg_params: WGParams,
+        removed_peers: list[str],
+        added_peers: list[tuple[Config, KeyPair]],
+    ):
+        """Apply removed and added peers to the running interface with one `wg set`"""
+        peers = [f"peer {quote(public_key)} remove" for public_key in removed_peers]
+        peers += [
+            f"peer {quote(key_pair.public_key)}"
+            f" preshared-key <(printf '%s' {quote(key_pair.pre_shared_key)})"
+            f" allowed-ips {config.client_ip_v4}/32,{config.client_ip_v6}/128"
+            for config, key_pair in added_peers
+        ]
+        batch.add(
+            f"wg set {quote(wg_params.SERVER_WG_NIC)} " + " ".join(peers),
+            name="wg set",
+        )
+
+    @staticmethod
+    def _sync_interface(batch: CommandBatch, wg_params: WGParams):
+        """Replace the peers of the running interface with the ones from its config file"""
+        nic = quote(wg_params.SERVER_WG_NIC)
+        batch.add(f"wg syncconf {nic} <(wg-quick strip {nic})", name="wg syncconf")
@@ -0,0 +1,184 @@
+import os
+import re
+from abc import ABC, abstractmethod
+from typing import Iterable
+
+from .batch import CommandBatch
+
+
+class FreezeBackend(ABC):
+    """
+    Способ блокировки трафика замороженных подключений на сервере.
+
+    Методы только добавляют команды в пакет, поэтому заморозку, разморозку
+    и чтение замороженных адресов можно выполнить одним запросом к серверу.
+    """
+
+    name = ""
+
+    def add_setup(self, batch: CommandBatch):
+        """
+        # Добавляет подготовку сервера, выполняется первой командой пакета.
+        """
+
+    @abstractmethod
+    def add_list(self, batch: CommandBatch) -> int:
+        """
+        # Добавляет команду получения замороженных адресов.
+        :return: Номер шага, вывод которого надо передать в `parse_list`.
+        """
+
+    @abstractmethod
+    def parse_list(self, output: str) -> set[str]:
+        pass
+
+    @abstractmethod
+    def add_freeze(self, batch: CommandBatch, ips: Iterable[str]):
+        pass
+
+    @abstractmethod
+    def add_unfreeze(self, batch: CommandBatch, ips: Iterable[str]):
+        pass
+
+
+class RouteFreezeBackend(FreezeBackend):
+    """
+    Маршрут до адреса клиента через 127.0.0.1, по одной команде на адрес.
+    """
+
+    name = "route"
+
+    def add_list(self, batch: CommandBatch) -> int:
+        return batch.add("ip -4 route show via 127.0.0.1", name="list frozen")
+
+    def parse_list(self, output: str) -> set[str]:
+        return {
+            line.split()[0].removesuffix("/32")
+            for line in output.splitlines()
+            if line.strip()
+        }
+
+    def add_freeze(self, batch: CommandBatch, ips: Iterable[str]):
+        for ip in ips:
+            # Если уже заморожено - код возврата 2
+            batch.add(
+                f"ip route add {ip} via 127.0.0.1",
+                name=f"freeze {ip}",
+                ok_statuses=(0, 2),
+            )
+
+    def add_unfreeze(self, batch: CommandBatch, ips: Iterable[str]):
+        for ip in ips:
+            # Если уже разморожено - код возврата 2
+            batch.add(
+                f"ip route del {ip} via 127.0.0.1",
+                name=f"unfreeze {ip}",
+                ok_statuses=(0, 2),
+            )
+
+
+class NftSetFreezeBackend(FreezeBackend):
+    """
+    Замороженные адреса хранятся в множестве nftables,
+    трафик с них и на них отбрасывается правилами таблицы `table`.
+    Любое количество адресов изменяется одной командой `nft`.
+
+    Разморозка также удаляет маршруты способа `route`, поэтому подключения,
+    замороженные до перехода на nft, размораживаются после оплаты
+    и при сверке с базой.
+    """
+
+    name = "nft"
+    table = "axo_vpn"
+    set_name = "frozen"
+
+    def _setup_command(self) -> str:
+        # Таблица создается один раз, при первом обращении к серверу.
+        return (
+            f"nft list table inet {self.table} >/dev/null 2>&1 || nft -f - <<'NFT'\n"
+            f"table inet {self.table} {{\n"
+            f"  set {self.set_name} {{ type ipv4_addr; }}\n"
+            f"  chain forward {{\n"
+            f"    type filter hook forward priority -10; policy accept;\n"
+            f"    ip saddr @{self.set_name} drop\n"
+            f"    ip daddr @{self.set_name} drop\n"
+            f"  }}\n"
+            f"  chain input {{\n"
+            f"    type filter hook input priority -10; policy accept;\n"
+            f"    ip saddr @{self.set_name} drop\n"
+            f"  }}\n"
+            f"}}\n"
+            f"NFT"
+        )
+
+    def add_setup(self, batch: CommandBatch):
+        batch.add(self._setup_command(), name="nft setup")
+
+    def _elements(self, ips: Iterable[str]) -> str:
+        return "{ " + ", ".join(ips) + " }"
+
+    def add_list(self, batch: CommandBatch) -> int:
+        # Маршруты через 127.0.0.1 остаются от способа `route`, если подключение
+        # заморозили до перехода на nft, такие адреса тоже считаются замороженными.
+        return batch.add(
+            f"nft list set inet {self.table} {self.set_name}"
+            f" && ip -4 route show via 127.0.0.1 | sed 's/^/route /'",
+            name="list frozen",
+        )
+
+    def parse_list(self, output: str) -> set[str]:
+        routes = [line for line in output.splitlines() if line.startswith("route ")]
+        _, _, elements = output.partition("elements")
+        elements = "\n".join(
+            line for line in elements.splitlines() if not line.startswith("route ")
+        )
+        return set(re.findall(r"\d+\.\d+\.\d+\.\d+", elements)) | {
+            line.split()[1].removesuffix("/32") for line in routes
+        }
+
+    def add_freeze(self, batch: CommandBatch, ips: Iterable[str]):
+        ips = list(ips)
+        if not ips:
+            return
+        # `add element` не считает ошибкой уже добавленные адреса.
+        batch.add(
+            f"nft add element inet {self.table} {self.set_name} {self._elements(ips)}",
+            name="freeze",
+        )
+
+    def add_unfreeze(self, batch: CommandBatch, ips: Iterable[str]):
+        ips = list(ips)
+        if not ips:
+            return
+        # `delete element` завершается ошибкой, если адреса нет в множестве,
+        # поэтому сначала добавляем все адреса, а затем удаляем их одной транзакцией.
+        elements = self._elements(ips)
+        batch.add(
+            f"nft -f - <<'NFT'\n"
+            f"add element inet {self.table} {self.set_name} {elements}\n"
+            f"delete element inet {self.table} {self.set_name} {elements}\n"
+            f"NFT",
+            name="unfreeze",
+        )
+        # Подключения, замороженные до перехода на nft, заблокированы маршрутом.
+        RouteFreezeBackend().add_unfreeze(batch, ips)
+
+
+freeze_backends: dict[str, type[FreezeBackend]] = {
+    RouteFreezeBackend.name: RouteFreezeBackend,
+    NftSetFreezeBackend.name: NftSetFreezeBackend,
+}
+
+
+def get_freeze_backend(name: str | None = None) -> FreezeBackend:
+    """
+    # Способ заморозки по названию, по умолчанию из переменной FREEZE_BACKEND.
+    """
+    name = name or os.getenv("FREEZE_BACKEND", RouteFreezeBackend.name)
+    try:
+        return freeze_backends[name]()
+    except KeyError:
+        raise ValueError(
+            f"Неизвестный FREEZE_BACKEND: {name},"
+            f" доступны: {', '.join(freeze_backends)}"
+        )
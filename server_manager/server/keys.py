@@ -0,0 +1,113 @@
+import asyncio
+import base64
+import logging
+import secrets
+from collections import deque
+
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+from cryptography.hazmat.primitives.serialization import (
+    Encoding,
+    NoEncryption,
+    PrivateFormat,
+    PublicFormat,
+)
+
+from .types import KeyPair
+
+
+def _encode(key: bytes) -> str:
+    return base64.b64encode(key).decode()
+
+
+def public_key_from_private(private_key: str) -> str:
+    """
+    # Публичный ключ wireguard (аналог `wg pubkey`) по закрытому ключу в base64.
+    """
+    private = X25519PrivateKey.from_private_bytes(base64.b64decode(private_key))
+    return _encode(private.public_key().public_bytes(Encoding.Raw, PublicFormat.Raw))
+
+
+def generate_keypair() -> KeyPair:
+    """
+    Генерирует ключи клиента wireguard без обращения к серверу.
+
+    Закрытый ключ Curve25519 формируется так же, как `wg genkey`,
+    общий ключ (`wg genpsk`) - 32 случайных байта.
+    """
+    private_bytes = bytearray(secrets.token_bytes(32))
+    # Ограничение ключа (clamping) по RFC 7748.
+    private_bytes[0] &= 248
+    private_bytes[31] = (private_bytes[31] & 127) | 64
+
+    private = X25519PrivateKey.from_private_bytes(bytes(private_bytes))
+    return KeyPair(
+        private_key=_encode(
+            private.private_bytes(Encoding.Raw, PrivateFormat.Raw, NoEncryption())
+        ),
+        public_key=_encode(
+            private.public_key().public_bytes(Encoding.Raw, PublicFormat.Raw)
+        ),
+        pre_shared_key=_encode(secrets.token_bytes(32)),
+    )
+
+
+class KeyPairPool:
+    """
+    Запас заранее сгенерированных ключей клиентов.
+
+    Когда ключей остается меньше `low_watermark`, пул пополняется
+    до `size` в фоне, в отдельном потоке.
+    Если запас закончился, ключи генерируются сразу при запросе.
+    """
+
+    def __init__(self, size: int = 64, low_watermark: int = 16):
+        self.size = size
+        self.low_watermark = low_watermark
+        self._keys: deque[KeyPair] = deque()
+        self._refill_task: asyncio.Task | None = None
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def get(self) -> KeyPair:
+        """
+        # Возвращает новую, еще не использованную пару ключей.
+        """
+        try:
+            key_pair = self._keys.popleft()
+        except IndexError:
+            key_pair = generate_keypair()
+
+        if len(self._keys) < self.low_watermark:
+            self._schedule_refill()
+        return key_pair
+
+    def _schedule_refill(self):
+        if self._refill_task is not None and not self._refill_task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Нет цикла событий - пополнять пул некому, ключи создаются по запросу.
+            return
+        self._refill_task = loop.create_task(self.refill())
+
+    async def refill(self):
+        """
+        # Пополняет пул до `size` ключей.
+        """
+        count = self.size - len(self._keys)
+        if count <= 0:
+            return
+        try:
+            key_pairs = await asyncio.get_running_loop().run_in_executor(
+                None, lambda: [generate_keypair() for _ in range(count)]
+            )
+        except Exception as exc:
+            self.logger.error(f"Ошибка генерации ключей: {exc}", exc_info=exc)
+            return
+        self._keys.extend(key_pairs)
+
+
+keypair_pool = KeyPairPool()
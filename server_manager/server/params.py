@@ -0,0 +1,56 @@
+import time
+from dataclasses import dataclass
+
+from .types import WGParams
+
+
+@dataclass
+class CachedWGParams:
+    params: WGParams
+    # Время изменения, размер и inode файла на момент чтения.
+    token: str
+    checked_at: float
+
+
+class WGParamsCache:
+    """
+    Параметры wireguard каждого сервера.
+
+    В течение `revalidate_after` секунд после проверки параметры берутся
+    из кэша без обращения к серверу. Затем файл читается заново,
+    только если изменились его время изменения, размер или inode.
+    """
+
+    def __init__(self, revalidate_after: int = 60):
+        self.revalidate_after = revalidate_after
+        self._items: dict[int, CachedWGParams] = {}
+
+    def get(self, server_id: int) -> CachedWGParams | None:
+        return self._items.get(server_id)
+
+    def is_fresh(self, cached: CachedWGParams) -> bool:
+        return time.monotonic() - cached.checked_at < self.revalidate_after
+
+    def set(self, server_id: int, params: WGParams, token: str):
+        self._items[server_id] = CachedWGParams(
+            params=params, token=token, checked_at=time.monotonic()
+        )
+
+    def touch(self, server_id: int):
+        """
+        # Отмечает, что параметры сервера проверены и не изменились.
+        """
+        if server_id in self._items:
+            self._items[server_id].checked_at = time.monotonic()
+
+    def invalidate(self, server_id: int | None = None):
+        """
+        # Сбрасывает параметры сервера, либо всех серверов.
+        """
+        if server_id is None:
+            self._items.clear()
+        else:
+            self._items.pop(server_id, None)
+
+
+wg_params_cache = WGParamsCache()
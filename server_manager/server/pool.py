@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+
+import asyncssh
+from asyncssh import SSHClientConnection
+
+
+@dataclass
+class PooledConnection:
+    """
+    Одно SSH подключение к серверу, которое используется повторно.
+    """
+
+    conn: SSHClientConnection
+    auth: dict
+    last_used: float = field(default_factory=time.monotonic)
+    last_checked: float = field(default_factory=time.monotonic)
+
+
+class ServerConnectionPool:
+    """
+    Пул долгоживущих SSH подключений к серверам.
+
+    На каждый сервер (по его идентификатору) держит одно подключение,
+    по которому мультиплексируются все команды менеджеров.
+    Проверяет подключение перед выдачей, переподключается при обрыве
+    и закрывает подключения, которые долго не используются.
+    """
+
+    def __init__(
+        self,
+        idle_timeout: int = 60 * 30,
+        health_check_interval: int = 60,
+        connect_timeout: int = 10,
+        keepalive_interval: int = 30,
+    ):
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.connect_timeout = connect_timeout
+        self.keepalive_interval = keepalive_interval
+
+        self._connections: dict[int, PooledConnection] = {}
+        self._locks: dict[int, asyncio.Lock] = {}
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    async def acquire(self, server_id: int, auth: dict) -> SSHClientConnection:
+        """
+        # Возвращает рабочее SSH подключение к серверу.
+        :param server_id: Идентификатор сервера.
+        :param auth: Параметры подключения для `asyncssh.connect`.
+        :return: Подключение, которое нельзя закрывать вызывающему коду.
+        """
+
+        lock = self._locks.setdefault(server_id, asyncio.Lock())
+        async with lock:
+            pooled = self._connections.get(server_id)
+
+            if pooled is not None and (
+                pooled.auth != auth or not await self._is_alive(pooled)
+            ):
+                # Изменились данные сервера, либо подключение оборвалось.
+                self._close(server_id)
+                pooled = None
+
+            if pooled is None:
+                pooled = PooledConnection(conn=await self._connect(auth), auth=auth)
+                self._connections[server_id] = pooled
+
+            pooled.last_used = time.monotonic()
+            return pooled.conn
+
+    def invalidate(self, server_id: int) -> None:
+        """
+        # Закрывает подключение к серверу, следующий запрос создаст новое.
+        """
+        self._close(server_id)
+
+    async def run(self):
+        """
+        # Периодически закрывает подключения, которые долго не использовались.
+        """
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            self.evict_idle()
+
+    def evict_idle(self) -> None:
+        now = time.monotonic()
+        for server_id, pooled in list(self._connections.items()):
+            if now - pooled.last_used > self.idle_timeout:
+                self.logger.info(
+                    f"# Сервер: {server_id:<5} | Закрываем простаивающее подключение"
+                )
+                self._close(server_id)
+
+    async def close(self) -> None:
+        for server_id in list(self._connections):
+            self._close(server_id)
+
+    async def _connect(self, auth: dict) -> SSHClientConnection:
+        return await asyncio.wait_for(
+            asyncssh.connect(**auth, keepalive_interval=self.keepalive_interval),
+            timeout=self.connect_timeout,
+        )
+
+    async def _is_alive(self, pooled: PooledConnection) -> bool:
+        if time.monotonic() - pooled.last_checked < self.health_check_interval:
+            return True
+
+        try:
+            await pooled.conn.run("true", check=True, timeout=3)
+        except (OSError, asyncssh.Error, asyncssh.ProcessError, asyncio.TimeoutError):
+            return False
+
+        pooled.last_checked = time.monotonic()
+        return True
+
+    def _close(self, server_id: int) -> None:
+        pooled = self._connections.pop(server_id, None)
+        if pooled is not None:
+            pooled.conn.close()
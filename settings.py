@@ -11,6 +11,7 @@ WEB_SERVER_HOST = "127.0.0.1"
 WEB_SERVER_PORT = 8888
 
 BOT_PATH = f"/webhook/bot/{TOKEN[:23]}"
+PAYMENT_WEBHOOK_PATH = "/webhook/payment"
 
 BASE_DIR = pathlib.Path(__file__).parent
 